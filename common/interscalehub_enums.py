@@ -33,11 +33,25 @@ class DATA_BUFFER_STATES(enum.IntEnum):
     TERMINATE = 4
     
 
+@enum.unique
+class DATA_BUFFER_HEADER_FIELDS(enum.IntEnum):
+    """ Enum class for the fields of the header of a data buffer slot"""
+    STATE = 0  # see DATA_BUFFER_STATES
+    LENGTH = 1  # number of data points in the slot
+    SEQUENCE_NUMBER = 2  # publishes the slot, set at last
+    STEP = 3  # step of the simulation the data belongs to
+    PRODUCER_START_TIMESTAMP = 4  # ns, when the producer starts filling
+    PRODUCER_END_TIMESTAMP = 5  # ns, when the producer publishes
+    LAYOUT_VERSION = 6  # version of the layout of the slot
+    RESERVED = 7
+
+
 @enum.unique
 class DATA_BUFFER_TYPES(enum.IntEnum):
     """ Enum class for different buffer types"""
     INPUT = 0
     OUTPUT = 1
+    INDEX = 2  # spike events of the INPUT buffer grouped by neuron
 
 
 @enum.unique
@@ -46,3 +60,60 @@ class TRANSLATION_FUNCTION_ID(enum.IntEnum):
     SPIKE_TO_RATES = 0
     RATE_TO_SPIKES = 1
     USER_LAND = 2
+
+
+@enum.unique
+class BUFFER_WAIT_MODES(enum.IntEnum):
+    """ Enum class for the modes of waiting for a buffer state change"""
+    SLEEP = 0  # poll and sleep 1 ms in between
+    SPIN = 1  # busy polling
+    ADAPTIVE = 2  # spin, then yield, then sleep with exponential backoff
+
+
+@enum.unique
+class RATE_ENGINES(enum.IntEnum):
+    """ Enum class for the engines to convert spikes to rates"""
+    NATIVE = 0  # histogram and box filter with NumPy
+    ELEPHANT = 1  # reference i.e. elephant.statistics.instantaneous_rate
+    VALIDATE = 2  # compute both, log the deviation, use the reference
+
+
+@enum.unique
+class CONTROL_BLOCK_FIELDS(enum.IntEnum):
+    """ Enum class for the fields of the shared memory control block"""
+    STEP = 0  # number of steps announced to the transformers
+    TERMINATE = 1  # 1 if the transformers have to terminate, 0 otherwise
+
+
+@enum.unique
+class OVERFLOW_REGION_FIELDS(enum.IntEnum):
+    """ Enum class for the fields of an overflow region of a data buffer slot"""
+    OWNER = 0  # rank (in the intra communicator) which holds the region
+    START = 1  # index in the slot where the region starts, -1 if unused
+    END = 2  # index in the slot where the region ends, -1 if unused
+    ADDRESS = 3  # address of the region in the dynamic MPI window
+
+
+@enum.unique
+class NUMA_PLACEMENTS(enum.IntEnum):
+    """ Enum class for the placements of the buffers on the NUMA nodes"""
+    DEFAULT = 0  # first-touched by the rank which allocates the buffer
+    FIRST_TOUCH = 1  # first-touched by the ranks which consume the buffer
+    INTERLEAVE = 2  # pages interleaved over all NUMA nodes
+    PER_SOCKET = 3  # slots placed on the NUMA nodes round robin
+
+
+@enum.unique
+class SPIKE_EVENT_ENCODINGS(enum.IntEnum):
+    """ Enum class for the encodings of the spike events in the INPUT buffer"""
+    RAW = 0  # as sent by NEST i.e. (detector id, neuron id, time) as doubles
+    COMPACT_TICKS = 1  # (neuron index, time in ticks of dt) as int32
+    COMPACT_FLOAT32 = 2  # (neuron index as int32, time as float32)
+
+
+@enum.unique
+class SOURCE_MARKER_FIELDS(enum.IntEnum):
+    """ Enum class for the fields of the completion marker of a source in a slot"""
+    START = 0  # index in the slot where the package of the source starts
+    END = 1  # index in the slot where the package of the source ends
+    STEP = 2  # step of the package, set at last, -1 if none yet
@@ -11,9 +11,6 @@
 #       Team: Multi-scale Simulation and Design
 #
 # ------------------------------------------------------------------------------ 
-import time
-
-from EBRAINS_RichEndpoint.application_companion.common_enums import Response
 
 
 def log_exception(logger, log_message, mpi_tag_received):
@@ -35,16 +32,3 @@ def debug_log_message(rank, logger, msg):
     "helper function to control the log emissions as per rank"
     if rank == 0:        
         logger.debug(msg)
-   
-
-def wait_until_buffer_ready(data_buffer_manager, buffer_type, buffer_state):
-    while data_buffer_manager.get_at(index=-1,
-                                     buffer_type=buffer_type) != buffer_state:
-        # buffer is not ready yet
-        time.sleep(0.001)
-        # continue next iteration
-        continue
-    
-    # buffer is ready
-    return Response.OK
-
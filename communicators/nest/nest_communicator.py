@@ -11,13 +11,20 @@
 #       Team: Multi-scale Simulation and Design
 #
 # ------------------------------------------------------------------------------ 
-from mpi4py import MPI
 import time
+
+from mpi4py import MPI
 import numpy as np
 
 from EBRAINS_InterscaleHUB.communicators.base_communicator import BaseCommunicator
 from EBRAINS_InterscaleHUB.common import interscalehub_utils
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_BUFFER_STATES, DATA_BUFFER_TYPES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import SPIKE_EVENT_ENCODINGS
+from EBRAINS_InterscaleHUB.managers.general.buffer_state_waiter import WaitLatencyHistogram
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import encode_spike_events
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import decode_spike_events
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import decode_compact_spike_events
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import COMPACT_SPIKE_EVENT_DTYPES
 
 from EBRAINS_RichEndpoint.application_companion.common_enums import Response
 
@@ -39,7 +46,15 @@ class NestCommunicator(BaseCommunicator):
                  sender_group_ranks,
                  receiver_group_ranks,
                  root_transformer_rank,
-                 spike_detector_ids):
+                 spike_detector_ids,
+                 concurrent_receive=True,
+                 batched_status_check=True,
+                 spike_event_encoding=SPIKE_EVENT_ENCODINGS.RAW,
+                 first_neuron_id=0,
+                 dt=None,
+                 nb_neurons=None,
+                 receiver_intra_comm=None,
+                 sender_intra_comm=None):
         # initialize the common settings such as logger, data buffer, etc.
         super().__init__(configurations_manager,
                          log_settings,
@@ -53,20 +68,51 @@ class NestCommunicator(BaseCommunicator):
                          root_transformer_rank
                          )
         self.__spike_detector_ids = spike_detector_ids
+        # NOTE if set, the packages of all NEST ranks are received
+        # concurrently instead of one NEST rank after the other
+        self.__concurrent_receive = concurrent_receive
+        # NOTE if set, the status of all NEST ranks is received at once and
+        # the time spent waiting for the slowest NEST rank is recorded
+        self.__batched_status_check = batched_status_check
+        self.__straggler_wait_times = WaitLatencyHistogram()
+        # NOTE the spike recorder ids of a NEST rank do not change during the
+        # simulation, so the plan to pack its spike trains is cached
+        self.__packing_plans = {}
+        # NOTE unless the encoding is RAW, the spike events are received into
+        # a staging buffer and put into the INPUT buffer in a compact format
+        # (see SPIKE_EVENT_ENCODINGS), which takes a third of the space
+        if isinstance(spike_event_encoding, str):
+            spike_event_encoding = SPIKE_EVENT_ENCODINGS[spike_event_encoding.upper()]
+        self.__spike_event_encoding = SPIKE_EVENT_ENCODINGS(spike_event_encoding)
+        self.__first_neuron_id = first_neuron_id
+        self.__dt = dt if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.COMPACT_TICKS else None
+        self.__staging_buffer = None
+        self.__is_streaming = False
+        # NOTE the number of neurons is needed to group the spike events by
+        # neuron, if there is an INDEX buffer
+        self.__nb_neurons = nb_neurons
+        # NOTE each receiver is connected to its own NEST ranks, the
+        # receivers agree on the status of NEST via their intra communicator
+        self.__receiver_intra_comm = receiver_intra_comm
+        # NOTE same for the senders
+        self.__sender_intra_comm = sender_intra_comm
+        # number of the first NEST rank of this receiver among the NEST ranks
+        # of all receivers, see BufferManager.get_first_source
+        self.__first_source = 0
         
         interscalehub_utils.info_log_message(rank=self._my_rank,
                                              logger=self._logger,
                                              msg="Initialized")
 
-    def __check_nest_status(self, comm, num_remote_ranks, status_nest):
+    def __check_nest_status(self, comm, nest_ranks, status_nest):
         """
             helper function for first handshake with NEST and checks if NEST
             is ready to receive/send
         """
         check = np.empty(1,dtype='b')
-        comm.Recv([check, 1, MPI.CXX_BOOL], source=0, tag=MPI.ANY_TAG, status=status_nest)
+        comm.Recv([check, 1, MPI.CXX_BOOL], source=nest_ranks[0], tag=MPI.ANY_TAG, status=status_nest)
         status_rank_0 = status_nest.Get_tag()
-        for rank in range(1,num_remote_ranks):
+        for rank in nest_ranks[1:]:
             comm.Recv([check, 1, MPI.CXX_BOOL], source=rank, tag=MPI.ANY_TAG, status=status_nest)
             # Check if the state of the NEST is different between the ranks
             if status_rank_0 != status_nest.Get_tag():
@@ -81,31 +127,399 @@ class NestCommunicator(BaseCommunicator):
         # everything went well
         return status_nest
     
+    def __check_nest_status_batched(self, comm, nest_ranks, status_nest):
+        """
+            helper function for first handshake with NEST and checks if NEST
+            is ready to receive/send
+
+            NOTE the status of all NEST ranks is received at once and the time
+            between the first and the last NEST rank reporting its status is
+            recorded as the waiting time for the slowest NEST rank.
+        """
+        checks = np.empty(len(nest_ranks), dtype='b')
+        statuses = [MPI.Status() for _ in nest_ranks]
+        requests = [comm.Irecv([checks[i:i+1], 1, MPI.CXX_BOOL],
+                               source=rank,
+                               tag=MPI.ANY_TAG)
+                    for i, rank in enumerate(nest_ranks)]
+        # wait for the first NEST rank
+        first_rank = MPI.Request.Waitany(requests, status_nest)
+        start_time = time.perf_counter()
+        # wait for the rest of NEST ranks
+        MPI.Request.Waitall(requests, statuses)
+        self.__straggler_wait_times.record(time.perf_counter() - start_time)
+        # NOTE the status of the first NEST rank is returned by Waitany
+        statuses[first_rank] = status_nest
+
+        # Check if the state of the NEST is different between the ranks
+        for status in statuses:
+            if status.Get_tag() != status_nest.Get_tag():
+                # Log the exception with traceback
+                interscalehub_utils.log_exception(
+                    logger=self._logger,
+                    log_message="Abnormal state : the state of Nest is "
+                                "different between rank. Tag received: ",
+                    mpi_tag_received=status.Get_tag())
+                # Terminate with Error
+                return Response.ERROR
+
+        # everything went well
+        return status_nest
+
+    def __get_nest_status(self, comm, nest_ranks, status_nest):
+        """returns the status of NEST as per the chosen handshake variant"""
+        if self.__batched_status_check:
+            return self.__check_nest_status_batched(comm, nest_ranks, status_nest)
+        return self.__check_nest_status(comm, nest_ranks, status_nest)
+
+    def __agree_on_nest_status(self, group_intra_comm, status_nest):
+        """
+        makes sure that all ranks of the group (e.g. receivers) got the same
+        status from their NEST ranks, before the root of the group announces
+        the step to the transformers
+
+        NOTE a rank which failed to get the status takes part with the tag -1,
+        so that all ranks of the group terminate together
+
+        Returns
+        ------
+            the status, or Response.ERROR if it differs between the ranks of
+            the group or any rank failed to get it
+        """
+        if group_intra_comm is None or group_intra_comm.Get_size() == 1:
+            return status_nest
+        tag = -1 if status_nest == Response.ERROR else status_nest.Get_tag()
+        # maximum and (negated) minimum of the tags of the group
+        tags = np.array([tag, -tag], dtype=np.int64)
+        group_intra_comm.Allreduce(MPI.IN_PLACE, [tags, MPI.INT64_T], op=MPI.MAX)
+        if tags[0] != -tags[1]:
+            # Log the exception with traceback
+            interscalehub_utils.log_exception(
+                logger=self._logger,
+                log_message="Abnormal state : the state of Nest is "
+                            "different between the ranks of the group. "
+                            "Tag received: ",
+                mpi_tag_received=tag)
+            # Terminate with Error
+            return Response.ERROR
+        if tags[0] == -1:
+            # NOTE a specific exception is already logged
+            return Response.ERROR
+        return status_nest
+
+    def __log_straggler_wait_times(self):
+        """logs the time spent waiting for the slowest NEST rank"""
+        if self.__batched_status_check:
+            self._logger.info("waiting for the slowest NEST rank -- "
+                              f"{self.__straggler_wait_times.summary()}")
+
+    def __get_packing_plan(self, rank, spike_recorder_ids):
+        """
+        returns the cached plan to pack the spike trains for the given NEST
+        rank, the plan is (re)built if the NEST rank reports different spike
+        recorder ids
+
+        The plan consists of
+        'spike_recorder_ids': the spike recorder ids of the NEST rank,
+        'indices': the indices of the spike trains in the OUTPUT buffer,
+        'shapes': the preallocated header i.e. the total number of spikes
+        followed by the number of spikes of each spike train,
+        'data': the preallocated contiguous send buffer, grown if needed
+        """
+        plan = self.__packing_plans.get(rank)
+        if plan is not None and np.array_equal(plan['spike_recorder_ids'], spike_recorder_ids):
+            return plan
+
+        self._logger.debug(f"building the packing plan for NEST rank: {rank}")
+        plan = {'spike_recorder_ids': spike_recorder_ids.copy(),
+                'indices': spike_recorder_ids.astype(np.int64) - self.__spike_detector_ids,
+                'shapes': np.empty(spike_recorder_ids.shape[0] + 1, dtype='i'),
+                'data': np.empty(0, dtype='d')}
+        self.__packing_plans[rank] = plan
+        return plan
+
+    def __pack_spike_trains(self, plan, spike_train_starts, spike_train_ends, spike_times):
+        """
+        fills the shapes and the send buffer of the plan with the spike trains
+        of its spike recorders
+
+        Returns
+        ------
+            the view of the send buffer which holds the spike trains
+        """
+        starts = spike_train_starts[plan['indices']]
+        counts = spike_train_ends[plan['indices']] - starts
+        total_number_of_spikes = int(counts.sum())
+        shapes = plan['shapes']
+        shapes[0] = total_number_of_spikes
+        shapes[1:] = counts
+        if plan['data'].shape[0] < total_number_of_spikes:
+            # grow the send buffer
+            plan['data'] = np.empty(max(total_number_of_spikes, 2 * plan['data'].shape[0]), dtype='d')
+        data = plan['data'][:total_number_of_spikes]
+        # index of each spike in spike_times: the start of its spike train
+        # plus its position within the spike train
+        first_positions = np.cumsum(counts) - counts
+        spike_indices = np.repeat(starts - first_positions, counts)
+        spike_indices += np.arange(total_number_of_spikes, dtype=np.int64)
+        np.take(spike_times, spike_indices, out=data)
+        return data
+
     def __send_simulation_status_to_transformers(self,
                                                  root_rank,
-                                                 is_simulation_running):
-        """sends the current simulation staus to transformers"""
-        if self._intra_comm.Get_rank() == root_rank:
-            self._intra_comm.send(is_simulation_running,
-                                  dest=self._root_transformer_rank,
-                                  tag=0)
+                                                 is_simulation_running,
+                                                 step=None):
+        """
+        sends the current simulation staus to transformers via the shared
+        memory control block
+        """
+        if self._intra_comm.Get_rank() != root_rank:
+            return
+        if is_simulation_running:
+            self._data_buffer_manager.announce_step(step)
+        else:
+            self._data_buffer_manager.announce_termination()
     
+    def __reserve_ranges(self, slot, sizes):
+        """
+        reserves the buffer portion for the packages of all given sizes at
+        once, and splits it into disjoint portions with a prefix sum
+
+        Returns
+        ------
+            the offsets of the packages in the slot
+        """
+        offsets = np.zeros(sizes.shape[0] + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        offsets += self._data_buffer_manager.reserve_range(
+            size=int(offsets[-1]),
+            buffer_type=DATA_BUFFER_TYPES.INPUT,
+            slot=slot)
+        return offsets
+
+    def __get_receive_buffers(self, slot, offsets, my_index):
+        """
+        returns the buffers to receive the packages into, as per the given
+        offsets in the slot
+
+        NOTE the overflow is detected before receiving, the packages which do
+        not fit into the slot are received into the overflow region of this
+        receiver instead
+        """
+        capacity = self._data_buffer_manager.get_capacity(DATA_BUFFER_TYPES.INPUT)
+        # index of the first package which does not fit into the slot
+        first_overflowing = int(np.searchsorted(offsets[1:], capacity, side='right'))
+        receive_buffers = [self._data_buffer_manager.get_from_range(
+                               start=offsets[i],
+                               end=offsets[i+1],
+                               buffer_type=DATA_BUFFER_TYPES.INPUT,
+                               slot=slot)
+                           for i in range(first_overflowing)]
+        # Case a, all packages fit into the slot
+        if first_overflowing == offsets.shape[0] - 1:
+            self._data_buffer_manager.clear_overflow_region(
+                producer=my_index,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+            return receive_buffers
+
+        # Case b, the slot overflows
+        overflow_start = int(offsets[first_overflowing])
+        overflow_buffer = self._data_buffer_manager.get_overflow_buffer(
+            producer=my_index,
+            start=overflow_start,
+            end=int(offsets[-1]),
+            buffer_type=DATA_BUFFER_TYPES.INPUT,
+            slot=slot)
+        self._logger.debug(f"slot {slot} overflows, receiving "
+                           f"{int(offsets[-1]) - overflow_start} data points "
+                           "into the overflow region")
+        receive_buffers.extend(overflow_buffer[offsets[i] - overflow_start:offsets[i+1] - overflow_start]
+                               for i in range(first_overflowing, offsets.shape[0] - 1))
+        return receive_buffers
+
+    def __prepare_receive(self, slot, sizes, my_index):
+        """
+        reserves the ranges of the packages of the given sizes in the slot
+
+        Returns
+        ------
+            the buffers to receive the packages into, the buffers in the
+            slot (or overflow region) where the packages end up, and the
+            offsets of the packages in the slot
+
+        NOTE the buffers are the same unless the spike events are encoded
+        compactly, then the packages are received into the staging buffer and
+        encoded into the slot afterwards, see __complete_package
+        """
+        # Case a, the spike events are kept as sent by NEST
+        if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.RAW:
+            offsets = self.__reserve_ranges(slot, sizes)
+            receive_buffers = self.__get_receive_buffers(slot, offsets, my_index)
+            return receive_buffers, receive_buffers, offsets
+
+        # Case b, a compact spike event takes a single data point of the slot
+        offsets = self.__reserve_ranges(slot, sizes // 3)
+        slot_buffers = self.__get_receive_buffers(slot, offsets, my_index)
+        staging_offsets = np.zeros(sizes.shape[0] + 1, dtype=np.int64)
+        np.cumsum(sizes, out=staging_offsets[1:])
+        if self.__staging_buffer is None or self.__staging_buffer.shape[0] < staging_offsets[-1]:
+            self.__staging_buffer = np.empty(staging_offsets[-1], dtype='d')
+        receive_buffers = [self.__staging_buffer[staging_offsets[i]:staging_offsets[i+1]]
+                           for i in range(sizes.shape[0])]
+        return receive_buffers, slot_buffers, offsets
+
+    def __complete_package(self, i, source, receive_buffers, slot_buffers,
+                           offsets, step, slot):
+        """
+        puts the i-th received package, from the given NEST rank, into the
+        slot: encodes it compactly, if needed, and marks it as received, if
+        the transformers translate the packages as soon as they are received
+        """
+        if self.__spike_event_encoding != SPIKE_EVENT_ENCODINGS.RAW:
+            compact_spike_event_dtype = COMPACT_SPIKE_EVENT_DTYPES[self.__spike_event_encoding]
+            encode_spike_events(receive_buffers[i],
+                                slot_buffers[i].view(compact_spike_event_dtype),
+                                self.__first_neuron_id,
+                                self.__dt)
+        if self.__is_streaming:
+            self._data_buffer_manager.mark_source_received(
+                source=self.__first_source + source,
+                start=int(offsets[i]),
+                end=int(offsets[i+1]),
+                step=step,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+
+    def __index_spike_events(self, slot):
+        """
+        groups the spike events of the slot by neuron into the INDEX buffer,
+        so that every transformer finds the spike events of its neurons
+        without scanning all spike events
+        """
+        data = self._data_buffer_manager.get_data(buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                  slot=slot)
+        # Case a, the spike events are as sent by NEST
+        if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.RAW:
+            spike_event_offsets, spike_times = decode_spike_events(
+                data, self.__first_neuron_id, self.__nb_neurons)
+        # Case b, the spike events are encoded compactly
+        else:
+            spike_event_offsets, spike_times = decode_compact_spike_events(
+                data.view(COMPACT_SPIKE_EVENT_DTYPES[self.__spike_event_encoding]),
+                self.__nb_neurons,
+                self.__dt)
+        if not self._data_buffer_manager.set_spike_index(spike_event_offsets,
+                                                         spike_times,
+                                                         slot):
+            self._logger.debug(f"spike index does not fit into slot: {slot}, "
+                               "the transformers group the spike events")
+
+    def __receive_sequentially(self, step, slot, nest_ranks, sizes, status_nest, my_index):
+        """
+        receives the packages from the given NEST ranks one after the other
+        into disjoint ranges of the given slot of the INPUT buffer
+        """
+        # NOTE the following 3 MPI calls are matching the protocol of
+        # mpi_backend_io in NEST
+        for i, source in enumerate(nest_ranks):
+            # i) send 'ready' to the nest rank
+            self._receiver_inter_comm.Send([np.array(True,dtype='b'),MPI.BOOL],dest=source,tag=0)
+            # ii) receive package size info
+            self._receiver_inter_comm.Recv([sizes[i:i+1], 1, MPI.INT], source=source, tag=0, status=status_nest)
+        # reserve the buffer portion to receive the data packages
+        # NOTE all sizes are known before any data is received, so the
+        # overflow is detected before receiving
+        receive_buffers, slot_buffers, offsets = self.__prepare_receive(slot, sizes, my_index)
+        for i, source in enumerate(nest_ranks):
+            # iii) receive the data in the buffer
+            self._receiver_inter_comm.Recv([receive_buffers[i], MPI.DOUBLE],
+                                           source=source,
+                                           tag=0,
+                                           status=status_nest)
+            self.__complete_package(i, source, receive_buffers, slot_buffers,
+                                    offsets, step, slot)
+
+    def __receive_concurrently(self, step, slot, nest_ranks, sizes, my_index):
+        """
+        receives the packages from all given NEST ranks at once into disjoint
+        ranges of the given slot of the INPUT buffer
+
+        NOTE the same 3 MPI calls as in __receive_sequentially are made, but
+        they are posted for all NEST ranks at once, so the round trips to the
+        NEST ranks overlap.
+        """
+        ready = np.array(True, dtype='b')
+        # i) send 'ready' to and ii) receive package size info from all NEST
+        # ranks
+        requests = []
+        for i, source in enumerate(nest_ranks):
+            requests.append(self._receiver_inter_comm.Isend([ready, MPI.BOOL], dest=source, tag=0))
+            requests.append(self._receiver_inter_comm.Irecv([sizes[i:i+1], 1, MPI.INT],
+                                                            source=source,
+                                                            tag=0))
+        MPI.Request.Waitall(requests)
+
+        # reserve the buffer portion for all data packages at once
+        receive_buffers, slot_buffers, offsets = self.__prepare_receive(slot, sizes, my_index)
+
+        # iii) receive the data of all NEST ranks in the buffer
+        requests = []
+        for source, data_buffer in zip(nest_ranks, receive_buffers):
+            requests.append(self._receiver_inter_comm.Irecv([data_buffer, MPI.DOUBLE],
+                                                            source=source,
+                                                            tag=0))
+        # NOTE the packages are completed in the order they arrive
+        for _ in range(len(requests)):
+            i = MPI.Request.Waitany(requests)
+            self.__complete_package(i, nest_ranks[i], receive_buffers, slot_buffers,
+                                    offsets, step, slot)
+
     def receive(self):
         '''
-            Receives data from NEST on rank 0 and puts it into the INPUT buffer
+            Receives data from NEST on the receiver ranks and puts it into the
+            INPUT buffer
+
+            NOTE each receiver receives from the NEST ranks connected to it
+            (i.e. all remote ranks of its own INTER communicator) and writes
+            into a disjoint range of the INPUT buffer slot, the last receiver
+            done with the slot publishes it to the transformers.
         '''
-        # NOTE The last two buffer indices are used for setting up buffer
-        # states and last index of data received (i.e. size of data)
+        # NOTE the state of a slot and the size of data received are kept
+        # in the header of the slot, see DATA_BUFFER_HEADER_FIELDS
         self._num_sending = self._receiver_inter_comm.Get_remote_size()
         root_receiving_rank = self._group_of_ranks_for_receiving[0]
-        size = np.empty(1, dtype='i')    
+        number_of_receivers = len(self._group_of_ranks_for_receiving)
+        # NOTE each receiver accepts its own connection, so all remote ranks
+        # of its INTER communicator are the NEST ranks of this receiver
+        my_nest_ranks = list(range(self._num_sending))
+        # index of this receiver e.g. to find its overflow region
+        my_index = self._group_of_ranks_for_receiving.index(self._my_rank)
+        # package sizes of the NEST ranks
+        sizes = np.empty(len(my_nest_ranks), dtype='i')
+        # NOTE the spike events are grouped by neuron only if there is an
+        # INDEX buffer
+        is_indexing = self._data_buffer_manager.get_number_of_slots(DATA_BUFFER_TYPES.INDEX) > 0
+        # NOTE the package of each NEST rank is marked as soon as it is
+        # received only if there are completion markers
+        self.__is_streaming = self._data_buffer_manager.has_source_markers(DATA_BUFFER_TYPES.INPUT)
+        if self.__is_streaming:
+            self.__first_source = self._data_buffer_manager.get_first_source(
+                producer=my_index,
+                buffer_type=DATA_BUFFER_TYPES.INPUT)
         status_nest = MPI.Status()
+        # NOTE the data of each step is received in the next slot of the
+        # ring of INPUT buffer slots
+        step = 0
         self._logger.info("start receiving from NEST")
         while True:
-            raw_data_end_index = 0  # head of the buffer, reset after each iteration
-            status_nest = self.__check_nest_status(self._receiver_inter_comm,
-                                                   self._num_sending,
-                                                   status_nest)
+            status_nest = self.__get_nest_status(self._receiver_inter_comm,
+                                                 my_nest_ranks,
+                                                 status_nest)
+            # NOTE the receivers must agree on the status before the step is
+            # announced
+            status_nest = self.__agree_on_nest_status(self.__receiver_intra_comm,
+                                                      status_nest)
             if status_nest == Response.ERROR:
                 # something went wrong
                 # NOTE a specific exception is already logged with traceback
@@ -120,49 +534,58 @@ class NestCommunicator(BaseCommunicator):
                     # send the current simulation staus to transformers
                     self.__send_simulation_status_to_transformers(
                         root_rank=root_receiving_rank,
-                        is_simulation_running=True)
-                # NOTE consider using MPI, remove the sleep and refactor
-                # while loop to something more efficient
-
-                # wait until Transformer communciator set the buffer state
-                while self._data_buffer_manager.get_at(
-                    index=-1,
-                    buffer_type=DATA_BUFFER_TYPES.INPUT) != DATA_BUFFER_STATES.READY_TO_RECEIVE:
-                    time.sleep(0.001)
-                    continue
+                        is_simulation_running=True,
+                        step=step)
+                # wait until all transformers are done with the slot
+                slot = self._data_buffer_manager.get_slot_index(
+                    step, DATA_BUFFER_TYPES.INPUT)
+                self._data_buffer_manager.wait_until_slot_free(
+                    step=step,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT)
 
-                # Recevie the data from all NEST ranks
+                # Recevie the data from the NEST ranks of this receiver
+                if self.__concurrent_receive:
+                    self.__receive_concurrently(step, slot, my_nest_ranks, sizes, my_index)
+                else:
+                    self.__receive_sequentially(step, slot, my_nest_ranks, sizes, status_nest, my_index)
 
-                # NOTE the following 3 MPI calls are matching the protocol of
-                # mpi_backend_io in NEST
-                for source in range(self._num_sending):
-                    # i) send 'ready' to the nest rank
-                    self._receiver_inter_comm.Send([np.array(True,dtype='b'),MPI.BOOL],dest=source,tag=0)
-                    # ii) receive package size info
-                    self._receiver_inter_comm.Recv([size, 1, MPI.INT], source=source, tag=0, status=status_nest)
-                    # get the buffer portion to receive the next data package
-                    data_buffer = self._data_buffer_manager.get_from(
-                                    starting_index=raw_data_end_index,
-                                    buffer_type=DATA_BUFFER_TYPES.INPUT)
-                    # iii) receive the data in the buffer
-                    self._receiver_inter_comm.Recv([data_buffer, MPI.DOUBLE],
-                                                   source=source,
-                                                   tag=0,
-                                                   status=status_nest)
-                    # move index
-                    raw_data_end_index += size[0]
-                
-                # set the header to the last index where the data ends
-                self._data_buffer_manager.set_header_at(index=-2,
-                                                        header=raw_data_end_index,
-                                                        buffer_type=DATA_BUFFER_TYPES.INPUT)
+                # Case a, other receivers are still filling the slot
+                if not self._data_buffer_manager.mark_range_filled(
+                        number_of_producers=number_of_receivers,
+                        buffer_type=DATA_BUFFER_TYPES.INPUT,
+                        slot=slot):
+                    step += 1
+                    continue
+
+                # Case b, this receiver is the last one done with the slot
+                raw_data_end_index = self._data_buffer_manager.get_filled_size(
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)
+                # set the length to the last index where the data ends
+                self._data_buffer_manager.set_data_length(length=raw_data_end_index,
+                                                          buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                          slot=slot)
+                # NOTE the slot is not refilled before it is published and
+                # consumed, so the fill counters can be reset already
+                self._data_buffer_manager.reset_fill_counters(
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)
+                # group the spike events by neuron for the transformers
+                if is_indexing:
+                    self.__index_spike_events(slot)
                 
                 # Mark as 'ready to do analysis/transform'
-                self._data_buffer_manager.set_ready_state_at(index=-1,
-                                                             state=DATA_BUFFER_STATES.READY_TO_TRANSFORM,
-                                                             buffer_type=DATA_BUFFER_TYPES.INPUT)
+                self._data_buffer_manager.set_state(state=DATA_BUFFER_STATES.READY_TO_TRANSFORM,
+                                                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                    slot=slot)
+                # publish the slot by setting the step the data belongs to
+                # NOTE the sequence number must be set at last
+                self._data_buffer_manager.set_sequence_number(sequence_number=step,
+                                                              buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                              slot=slot)
 
                 # continue next iteration
+                step += 1
                 continue
             
             # Case b, NEST is not ready to send the data yet
@@ -179,6 +602,7 @@ class NestCommunicator(BaseCommunicator):
                         root_rank=root_receiving_rank,
                         is_simulation_running=False)
 
+                self.__log_straggler_wait_times()
                 # everything goes fine
                 self._logger.info('NEST: End of receive function')
                 # terminate the loop and respond with OK
@@ -203,18 +627,31 @@ class NestCommunicator(BaseCommunicator):
     def send(self):
         '''
             Sends data to NEST
+
+            NOTE each sender sends to the NEST ranks connected to it (i.e.
+            all remote ranks of its own INTER communicator), directly from
+            the OUTPUT buffer slot
         '''
-        # NOTE Refactoring is needed to have multiple MPI ranks possible
         self._num_receiving = self._sender_inter_comm.Get_remote_size()
         root_sending_rank = self._group_of_ranks_for_sending[0]
+        my_index = self._group_of_ranks_for_sending.index(self._my_rank)
+        # NOTE each sender accepts its own connection, so all remote ranks
+        # of its INTER communicator are the NEST ranks of this sender
+        my_nest_ranks = list(range(self._num_receiving))
         num_spike_recorders = np.empty(1, dtype='i')
         status_nest = MPI.Status()
-        status_transformer = MPI.Status()
+        # NOTE the translated data of each step is in the next slot of the
+        # ring of OUTPUT buffer slots
+        step = 0
         self._logger.info("start sending data to NEST")
         while True:
-            status_nest = self.__check_nest_status(self._sender_inter_comm,
-                                                   self._num_receiving,
-                                                   status_nest)
+            status_nest = self.__get_nest_status(self._sender_inter_comm,
+                                                 my_nest_ranks,
+                                                 status_nest)
+            # NOTE the senders must agree on the status before the step is
+            # announced
+            status_nest = self.__agree_on_nest_status(self.__sender_intra_comm,
+                                                      status_nest)
             if status_nest == Response.ERROR:
                 # something went wrong
                 # NOTE a specific exception is already logged with traceback
@@ -227,16 +664,38 @@ class NestCommunicator(BaseCommunicator):
                 # send the current simulation staus to transformers
                 self.__send_simulation_status_to_transformers(
                     root_rank=root_sending_rank,
-                    is_simulation_running=True)
+                    is_simulation_running=True,
+                    step=step)
 
-                # wait to receive transformed data from transformers
-                if self._intra_comm.Get_rank() == root_sending_rank:
-                    spike_trains = self._intra_comm.recv(source=self._root_transformer_rank, tag=0, status=status_transformer)
+                # wait until transformers put the translated data into the
+                # OUTPUT buffer
+                slot = self._data_buffer_manager.get_slot_index(
+                    step, DATA_BUFFER_TYPES.OUTPUT)
+                self._data_buffer_manager.wait_until_sequence_number(
+                    sequence_number=step,
+                    buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                    slot=slot)
+                if self._data_buffer_manager.get_state(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                       slot=slot) == DATA_BUFFER_STATES.TERMINATE:
+                    # NOTE the transformers failed to translate the step, a
+                    # specific error is already logged by them
+                    self._logger.error(f"no translated data for step: {step}")
+                    return Response.ERROR
+                # NOTE the layout is (number of spike trains, starts of the
+                # spike trains..., ends of the spike trains..., spike
+                # times...), the data is a view of the slot unless the spike
+                # times overflow it
+                data = self._data_buffer_manager.get_data(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                          slot=slot)
+                number_of_spike_trains = int(data[0])
+                spike_train_starts = data[1:number_of_spike_trains+1].astype(np.int64)
+                spike_train_ends = data[number_of_spike_trains+1:2*number_of_spike_trains+1].astype(np.int64)
+                spike_times = data[2*number_of_spike_trains+1:]
                 
-                # send the data to all NEST ranks
+                # send the data to the NEST ranks of this sender
                 # NOTE the following 4 MPI calls are matching the protocol of
                 # mpi_backend_io in NEST
-                for rank in range(self._num_receiving):
+                for rank in my_nest_ranks:
                     # i) receive the number of spike recorders
                     self._sender_inter_comm.Recv([num_spike_recorders, 1, MPI.INT], source=rank, tag=0, status=status_nest)
                     if num_spike_recorders[0] != 0:
@@ -244,22 +703,26 @@ class NestCommunicator(BaseCommunicator):
                         # ii) receive the spike recorder ids
                         self._sender_inter_comm.Recv([spike_recorder_ids, num_spike_recorders, MPI.INT], source=status_nest.Get_source(), tag=0, status=status_nest)
 
-                        # put the spike trains into the correct list index
-                        data = []
-                        shape = []
-                        # NOTE this could be a bottleneck when we scale up
-                        for i in spike_recorder_ids:
-                            shape += [spike_trains[i-self.__spike_detector_ids].shape[0]]
-                            data += [spike_trains[i-self.__spike_detector_ids]]
-                        shape_of_spike_trains = np.array(np.concatenate(([np.sum(shape)],shape)), dtype='i')
+                        # put the spike trains into the send buffer as per
+                        # the (cached) packing plan of the NEST rank
+                        plan = self.__get_packing_plan(rank, spike_recorder_ids)
+                        data = self.__pack_spike_trains(plan, spike_train_starts, spike_train_ends, spike_times)
+                        shape_of_spike_trains = plan['shapes']
 
                         # iii) send the list of shapes of the spike trains
                         self._sender_inter_comm.Send([shape_of_spike_trains, MPI.INT], dest=status_nest.Get_source(), tag=spike_recorder_ids[0])
                         
                         # iv) send the spike trains
-                        data = np.concatenate(data).astype('d')
                         self._sender_inter_comm.Send([data, MPI.DOUBLE], dest=rank, tag=spike_recorder_ids[0])
+
+                # mark the step as sent, so that the slot can receive the next
+                # translated data as soon as all senders are done with it
+                self._data_buffer_manager.set_consumer_progress(
+                    consumer=my_index,
+                    step=step,
+                    buffer_type=DATA_BUFFER_TYPES.OUTPUT)
                 # continue next iteration
+                step += 1
                 continue
 
             # Case b, NEST is not ready yet
@@ -273,6 +736,7 @@ class NestCommunicator(BaseCommunicator):
                 self.__send_simulation_status_to_transformers(
                     root_rank=root_sending_rank,
                     is_simulation_running=False)
+                self.__log_straggler_wait_times()
                 # everything goes fine, terminate the loop and respond with OK
                 self._logger.info('NEST: End of send function')
                 return Response.OK
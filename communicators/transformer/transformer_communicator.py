@@ -15,9 +15,9 @@ from mpi4py import MPI
 import numpy as np
 
 from EBRAINS_InterscaleHUB.common.interscalehub_utils import info_log_message
-from EBRAINS_InterscaleHUB.common.interscalehub_utils import wait_until_buffer_ready
 from EBRAINS_InterscaleHUB.common.interscalehub_utils import debug_log_message
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_BUFFER_STATES, DATA_BUFFER_TYPES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import TRANSLATION_FUNCTION_ID, RATE_ENGINES
 from EBRAINS_InterscaleHUB.translator.translator import Translator
 
 from EBRAINS_RichEndpoint.application_companion.common_enums import Response
@@ -37,7 +37,9 @@ class TransformerCommunicator:
                  parameters,
                  sci_params,
                  translation_function_id,
-                 translation_function):
+                 translation_function,
+                 node_transformer_ranks=None,
+                 relay_comm=None):
         
         # intialize parameters
         self._log_settings = log_settings
@@ -74,97 +76,515 @@ class TransformerCommunicator:
             self._log_settings,
             self._parameters,
             self._sci_params)
+
+        # NOTE the transformers of a node share the buffers of the node, the
+        # data of a step is relayed to the other nodes via the relay
+        # communicator (see BaseManager)
+        if node_transformer_ranks is None:
+            node_transformer_ranks = transformer_group_ranks
+        self._relay_comm = relay_comm
+        self._is_multi_node = len(node_transformer_ranks) < len(transformer_group_ranks)
+        # index of the progress counter of this transformer on its node
+        self._consumer_index = None
+        if self._my_rank in node_transformer_ranks:
+            self._consumer_index = node_transformer_ranks.index(self._my_rank)
+        # (simulation status, length of the data) of a step
+        self._relayed_step_info = np.empty(2, dtype='d')
+        if self._is_multi_node and self._translator.distributed_output:
+            # NOTE the OUTPUT buffer is only shared on the node of the
+            # Senders group, so the results are gathered to the root
+            # transformer
+            self._translator.distributed_output = False
+            info_log_message(self._my_rank, self._logger,
+                             "running on several nodes, the translated data is "
+                             "gathered to the root transformer")
+
+        # NOTE the package of each NEST rank is translated as soon as it is
+        # received, if the receivers mark the packages as received (see
+        # BufferManager.mark_source_received).
+        # It is supported only for the native rate engine, which needs just
+        # the pooled spike times, and on a single node, as the markers are
+        # not relayed to the other nodes
+        self._is_streaming = False
+        self._streaming_sources = []
+        if self._data_buffer_manager.has_source_markers(DATA_BUFFER_TYPES.INPUT):
+            if self._is_multi_node or \
+                    self._translation_function_id != TRANSLATION_FUNCTION_ID.SPIKE_TO_RATES or \
+                    self._translator.rate_engine != RATE_ENGINES.NATIVE:
+                info_log_message(self._my_rank, self._logger,
+                                 "streaming transformation is not supported, "
+                                 "the whole step is translated at once")
+            else:
+                self._is_streaming = True
+                # NOTE the NEST ranks are assigned round-robin to the
+                # transformers
+                self._streaming_sources = list(range(
+                    self._transformer_intra_comm.Get_rank(),
+                    self._data_buffer_manager.get_number_of_sources(DATA_BUFFER_TYPES.INPUT),
+                    self._transformer_intra_comm.Get_size()))
         
         info_log_message(self._my_rank, self._logger, "initialized")
 
-    def __get_data(self, buffer_type):
-        '''converts rate to spike trains'''
-        raw_data_end_index = int(self._data_buffer_manager.get_at(index=-2, buffer_type=buffer_type))
-        received_data = self._data_buffer_manager.get_from_range(
-            start=0,
-            end=raw_data_end_index,
-            buffer_type=buffer_type)
-       
-        return received_data
+    def __get_data(self, buffer_type, slot):
+        '''
+        returns the data received in the given slot
+
+        NOTE it is a view of the slot, unless the data overflows the slot
+        '''
+        return self._data_buffer_manager.get_data(buffer_type=buffer_type,
+                                                  slot=slot)
         
-    def __set_buffer_ready(self, buffer_type, state):
-        self._data_buffer_manager.set_ready_state_at(index=-1,
-                                                     state=state,
-                                                     buffer_type=buffer_type)
-
-    def __is_simulation_running(self):
-        """helper function to determine whether simulation is still running"""
-        check = None
-        status_ = MPI.Status()
-        # Case a, two-way communication with simulator
-        if self._sender_group_ranks and self._intra_comm.Get_rank() == self._root_transformer_rank:
-            check = self._intra_comm.recv(source=self._root_sending_rank,
-                                          tag=MPI.ANY_TAG,
-                                          status=status_)
-
-        # Case b, one-way communication i.e. only receiving data from the simulator
-        elif not self._sender_group_ranks and self._intra_comm.Get_rank() == self._root_transformer_rank:
-            check = self._intra_comm.recv(source=self._root_receiver_rank,
-                                          tag=MPI.ANY_TAG,
-                                          status=status_)
-         
-        return check
+    def __put_data(self, translated_data, buffer_type, slot):
+        '''
+        writes the translated data into the given slot
+
+        Returns
+        ------
+            the index where the data ends in the slot, or None if the data
+            does not fit into the slot
+
+        NOTE the spike times which do not fit into the slot go into the
+        overflow region of the root transformer
+        '''
+        capacity = self._data_buffer_manager.get_capacity(buffer_type)
+        shared_memory_buffer = self._data_buffer_manager.get_upto(
+            end_index=capacity,
+            buffer_type=buffer_type,
+            slot=slot)
+
+        # Case a, rates, layout: (start time, end time, rates...)
+        if self._translation_function_id == TRANSLATION_FUNCTION_ID.SPIKE_TO_RATES:
+            times, rate = translated_data
+            data_end_index = 2 + rate.shape[0]
+            if data_end_index > capacity:
+                self._logger.error(f"rates of size: {data_end_index} do not "
+                                   f"fit into buffer of size: {capacity}")
+                return None
+            shared_memory_buffer[:2] = times
+            shared_memory_buffer[2:data_end_index] = rate
+
+        # Case b, spike trains, layout: (number of spike trains,
+        # starts of the spike trains..., ends of the spike trains...,
+        # spike times...)
+        # NOTE the starts and ends are relative to the first spike time
+        elif self._translation_function_id == TRANSLATION_FUNCTION_ID.RATE_TO_SPIKES:
+            spike_train_offsets, spike_times = translated_data
+            number_of_spike_trains = spike_train_offsets.shape[0] - 1
+            data_start_index = 2 * number_of_spike_trains + 1
+            if data_start_index > capacity:
+                self._logger.error(f"ranges of {number_of_spike_trains} spike "
+                                   f"trains do not fit into buffer of size: {capacity}")
+                return None
+            shared_memory_buffer[0] = number_of_spike_trains
+            shared_memory_buffer[1:number_of_spike_trains + 1] = spike_train_offsets[:-1]
+            shared_memory_buffer[number_of_spike_trains + 1:data_start_index] = spike_train_offsets[1:]
+            # NOTE the root transformer is the only producer
+            data_end_index = self.__put_spike_times(spike_times,
+                                                    data_start_index,
+                                                    0,
+                                                    buffer_type,
+                                                    slot)
+
+        # Case c, translation function does not support OUTPUT buffer
+        else:
+            self._logger.error("no OUTPUT buffer layout for translation "
+                               f"function: {self._translation_function_id}")
+            return None
+
+        return data_end_index
+
+    def __put_partial_spike_trains(self, partial_spike_trains, buffer_type, slot):
+        '''
+        writes the spike trains of the neurons of this transformer directly
+        into the given slot, in the same layout as __put_data
+
+        NOTE each transformer reserves the range of its spike times in the
+        slot atomically (see BufferManager.reserve_range), so the parts of
+        the transformers follow each other in the order in which they are
+        reserved, without a collective. The starts and ends of the spike
+        trains point to the part of their transformer.
+
+        Returns
+        ------
+            the index where the spike times start in the slot, or None if the
+            ranges of the spike trains do not fit into the slot
+        '''
+        first_neuron, spike_train_offsets, spike_times = partial_spike_trains
+        transformer_rank = self._transformer_intra_comm.Get_rank()
+        number_of_spike_trains = self._sci_params.nb_neurons
+        data_start_index = 2 * number_of_spike_trains + 1
+        capacity = self._data_buffer_manager.get_capacity(buffer_type)
+        if data_start_index > capacity:
+            # NOTE all transformers come to the same result
+            self._logger.error(f"ranges of {number_of_spike_trains} spike "
+                               f"trains do not fit into buffer of size: {capacity}")
+            return None
+
+        spikes_before = self._data_buffer_manager.reserve_range(
+            size=spike_times.shape[0],
+            buffer_type=buffer_type,
+            slot=slot)
+        shared_memory_buffer = self._data_buffer_manager.get_upto(
+            end_index=data_start_index,
+            buffer_type=buffer_type,
+            slot=slot)
+        if transformer_rank == 0:
+            shared_memory_buffer[0] = number_of_spike_trains
+        last_neuron = first_neuron + spike_train_offsets.shape[0] - 1
+        # starts and ends of the spike trains of this transformer
+        shared_memory_buffer[first_neuron + 1:last_neuron + 1] = \
+            spike_train_offsets[:-1] + spikes_before
+        shared_memory_buffer[number_of_spike_trains + first_neuron + 1:
+                             number_of_spike_trains + last_neuron + 1] = \
+            spike_train_offsets[1:] + spikes_before
+        # spike times of this transformer
+        self.__put_spike_times(spike_times,
+                               data_start_index + spikes_before,
+                               transformer_rank,
+                               buffer_type,
+                               slot)
+        return data_start_index
+
+    def __put_spike_times(self, spike_times, start_index, producer, buffer_type, slot):
+        '''
+        writes the spike times into the given slot from the start index on
+
+        NOTE the spike times which do not fit into the slot go into the
+        overflow region of the given producer (i.e. transformer), so the
+        slot must still be free
+
+        Returns
+        ------
+            the index where the spike times end
+        '''
+        capacity = self._data_buffer_manager.get_capacity(buffer_type)
+        end_index = start_index + spike_times.shape[0]
+        overflow_start_index = min(max(start_index, capacity), end_index)
+        # Case a, the spike times (or the first of them) fit into the slot
+        if overflow_start_index > start_index:
+            shared_memory_buffer = self._data_buffer_manager.get_from_range(
+                start=start_index,
+                end=overflow_start_index,
+                buffer_type=buffer_type,
+                slot=slot)
+            shared_memory_buffer[:] = spike_times[:overflow_start_index - start_index]
+        # Case b, the (remaining) spike times overflow the slot
+        if end_index > overflow_start_index:
+            overflow_buffer = self._data_buffer_manager.get_overflow_buffer(
+                producer=producer,
+                start=overflow_start_index,
+                end=end_index,
+                buffer_type=buffer_type,
+                slot=slot)
+            overflow_buffer[:] = spike_times[overflow_start_index - start_index:]
+        else:
+            self._data_buffer_manager.clear_overflow_region(
+                producer=producer,
+                buffer_type=buffer_type,
+                slot=slot)
+        return end_index
+
+    def __publish_output(self, count, data_end_index, slot):
+        '''makes the translated data of the given step available to the Senders group'''
+        self._data_buffer_manager.set_data_length(length=data_end_index,
+                                                  buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                  slot=slot)
+        # Mark as 'ready to send'
+        self.__set_buffer_ready(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                state=DATA_BUFFER_STATES.READY_TO_SEND,
+                                slot=slot)
+        # NOTE the sequence number must be set at last
+        self._data_buffer_manager.set_sequence_number(sequence_number=count,
+                                                      buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                      slot=slot)
+
+    def __abort_output(self, count, slot):
+        '''
+        publishes the given step with the TERMINATE state instead of the
+        translated data, so that the Senders group does not wait for it
+        forever, and signals the transformers to terminate
+        '''
+        self._data_buffer_manager.announce_termination()
+        self._data_buffer_manager.set_data_length(length=0,
+                                                  buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                  slot=slot)
+        self.__set_buffer_ready(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                state=DATA_BUFFER_STATES.TERMINATE,
+                                slot=slot)
+        # NOTE the sequence number must be set at last
+        self._data_buffer_manager.set_sequence_number(sequence_number=count,
+                                                      buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                      slot=slot)
+
+    def __set_buffer_ready(self, buffer_type, state, slot):
+        self._data_buffer_manager.set_state(state=state,
+                                            buffer_type=buffer_type,
+                                            slot=slot)
+
+    def __translate_streaming(self, count, slot):
+        '''
+        translates the packages of the NEST ranks assigned to this transformer
+        as soon as each of them is in the given slot, i.e. while the packages
+        of the other NEST ranks are still being received
+
+        NOTE the spike times of the packages are counted into a partial
+        histogram, the partial histograms of all transformers are summed up
+        on the root transformer, which gives the same rate as translating the
+        whole step at once.
+
+        Returns
+        ------
+            times, rate: numpy array, numpy array
+                on root transformer, None otherwise
+        '''
+        capacity = self._data_buffer_manager.get_capacity(DATA_BUFFER_TYPES.INPUT)
+        # NOTE an empty package gives the histogram with no spikes
+        partial_histogram = self._translator.spike_package_to_histogram(count, np.empty(0))
+        pending_sources = list(self._streaming_sources)
+        while pending_sources:
+            source = self._data_buffer_manager.wait_until_any_source_received(
+                step=count,
+                sources=pending_sources,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+            pending_sources.remove(source)
+            start, end = self._data_buffer_manager.get_source_range(
+                source=source,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+            # Case a, the package is in the slot
+            if end <= capacity:
+                package = self._data_buffer_manager.get_from_range(
+                    start=start,
+                    end=end,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)
+            # Case b, the package overflows the slot
+            # NOTE the overflow regions are only accessible once the step is
+            # published
+            else:
+                self._data_buffer_manager.wait_until_sequence_number(
+                    sequence_number=count,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)
+                package = self.__get_data(buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                          slot=slot)[start:end]
+            partial_histogram += self._translator.spike_package_to_histogram(count, package)
+
+        return self._translator.partial_histograms_to_rate(count,
+                                                           partial_histogram,
+                                                           self._transformer_intra_comm,
+                                                           self._translated_root_rank)
+
+    def __relay_step(self, count):
+        '''
+        relays the simulation status and the data of the given step from the
+        node of the Receivers group to the other nodes
+
+        NOTE the root transformer broadcasts them via the relay communicator,
+        the first rank on each other node puts them into the shared memory of
+        its node, so that the transformers there get the step as if it was
+        received on their node.
+        '''
+        step_info = self._relayed_step_info
+        slot = self._data_buffer_manager.get_slot_index(count, DATA_BUFFER_TYPES.INPUT)
+        capacity = self._data_buffer_manager.get_capacity(DATA_BUFFER_TYPES.INPUT)
+        # Case a, root transformer, on the node of the Receivers group
+        if self._relay_comm.Get_rank() == 0:
+            step_info[:] = 0
+            if self._data_buffer_manager.wait_until_step_announced(count):
+                self._data_buffer_manager.wait_until_sequence_number(
+                    sequence_number=count,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)
+                data = self.__get_data(buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                       slot=slot)
+                step_info[0] = 1
+                step_info[1] = data.shape[0]
+            self._relay_comm.Bcast([step_info, MPI.DOUBLE], root=0)
+            if step_info[0]:
+                self._relay_comm.Bcast([data[:capacity], MPI.DOUBLE], root=0)
+                if data.shape[0] > capacity:
+                    self._relay_comm.Bcast([data[capacity:], MPI.DOUBLE], root=0)
+            return
+
+        # Case b, first rank on another node
+        self._relay_comm.Bcast([step_info, MPI.DOUBLE], root=0)
+        # Case b.1, simulation is finished
+        if not step_info[0]:
+            self._data_buffer_manager.announce_termination()
+            return
+
+        # Case b.2, simulation is still running
+        length = int(step_info[1])
+        # wait until all transformers of the node are done with the slot
+        self._data_buffer_manager.wait_until_slot_free(
+            step=count,
+            buffer_type=DATA_BUFFER_TYPES.INPUT)
+        data_buffer = self._data_buffer_manager.get_upto(
+            end_index=min(length, capacity),
+            buffer_type=DATA_BUFFER_TYPES.INPUT,
+            slot=slot)
+        self._relay_comm.Bcast([data_buffer, MPI.DOUBLE], root=0)
+        # NOTE the data which does not fit into the slot goes into the
+        # overflow region of the node, as if this rank received it
+        if length > capacity:
+            overflow_buffer = self._data_buffer_manager.get_overflow_buffer(
+                producer=0,
+                start=capacity,
+                end=length,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+            self._relay_comm.Bcast([overflow_buffer, MPI.DOUBLE], root=0)
+        else:
+            self._data_buffer_manager.clear_overflow_region(
+                producer=0,
+                buffer_type=DATA_BUFFER_TYPES.INPUT,
+                slot=slot)
+        # NOTE the spike index is not relayed, the transformers of the node
+        # group the spike events themselves
+        self._data_buffer_manager.clear_spike_index(slot)
+        self._data_buffer_manager.set_data_length(length=length,
+                                                  buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                  slot=slot)
+        self.__set_buffer_ready(buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                state=DATA_BUFFER_STATES.READY_TO_TRANSFORM,
+                                slot=slot)
+        # NOTE the sequence number must be set at last
+        self._data_buffer_manager.set_sequence_number(sequence_number=count,
+                                                      buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                      slot=slot)
+        self._data_buffer_manager.announce_step(count)
 
     def transform(self):
         """
             transforms the data from input buffer and sends it to Senders group
+
+            NOTE the steps are pipelined without any global synchronization
+            of the transformers. A transformer fetches the data of a step as
+            soon as the data is published (i.e. the sequence number of the
+            slot is set) and marks the step as consumed after translating it.
+            The receivers refill a slot once all transformers consumed it, so
+            the transformers can be at most as many steps apart as there are
+            slots in the ring.
         """
         count = 0
         info_log_message(self._my_rank, self._logger, "start transformation")
         while True:
-            # receive current simulation status from Sender group
-            is_simulation_running = None 
-            # broadcast the current simulation status
-            self._logger.debug(f"broadcasting: is simulation running?")
-            is_simulation_running = self._transformer_intra_comm.bcast(
-                self.__is_simulation_running() , root=self._translated_root_rank)
+            # STEP 0. relay the step to the other nodes, if any
+            if self._relay_comm is not None:
+                self.__relay_step(count)
+
+            # STEP 1. get the current simulation status
+            # NOTE it is announced by the Senders group (or Receivers group in
+            # case of one-way communication) in the shared memory control block
+            self._logger.debug(f"waiting: is simulation running?")
+            is_simulation_running = self._data_buffer_manager.wait_until_step_announced(count)
 
             # Test, check the current status of simulation
             # Case a, simulation is still running
             if is_simulation_running:
-                self._logger.debug("waiting until data is received")
-                wait_until_buffer_ready(self._data_buffer_manager,
-                                        DATA_BUFFER_TYPES.INPUT,
-                                        DATA_BUFFER_STATES.READY_TO_TRANSFORM)
-                
-                # STEP 2. Transform the data
-                # get data from INPUT buffer
-                raw_data = self.__get_data(buffer_type=DATA_BUFFER_TYPES.INPUT)
-                #  wait until all transformers get the data from buffer
-                self._logger.debug("waiting unitl data is fetched from buffer")
-                self._transformer_intra_comm.Barrier()
-                # NOTE Mark the input buffer as
-                # 'ready to receive next simulation step'
-                if self._data_buffer_manager.get_at(index=-1, 
-                                              buffer_type=DATA_BUFFER_TYPES.INPUT) != DATA_BUFFER_STATES.TERMINATE:
-
-                    self.__set_buffer_ready(buffer_type=DATA_BUFFER_TYPES.INPUT,
-                                            state=DATA_BUFFER_STATES.READY_TO_RECEIVE)
-
-                # STEP 3. translate the data
-                # NOTE the results are gathered to only the root_transformer_rank
-                self._logger.debug("translating the data")
-                translated_data = self._translator.translate(
-                    self._translation_function_id,
-                    self._translation_function,
-                    count,
-                    raw_data,
-                    self._transformer_intra_comm,
-                    self._translated_root_rank)
+                # the data of the current step is in the next slot of the ring
+                slot = self._data_buffer_manager.get_slot_index(
+                    count, DATA_BUFFER_TYPES.INPUT)
+
+                # Case a, translate the packages of the NEST ranks as soon as
+                # they are received
+                if self._is_streaming:
+                    self._logger.debug(f"translating the packages received in slot: {slot}")
+                    translated_data = self.__translate_streaming(count, slot)
+                    # NOTE the slot is marked as consumed only after it is
+                    # published, so that the receivers do not refill it
+                    # while it is still being published
+                    self._data_buffer_manager.wait_until_sequence_number(
+                        sequence_number=count,
+                        buffer_type=DATA_BUFFER_TYPES.INPUT,
+                        slot=slot)
+
+                # Case b, translate the data once all of it is received
+                else:
+                    self._logger.debug(f"waiting until data is received in slot: {slot}")
+                    self._data_buffer_manager.wait_until_sequence_number(
+                        sequence_number=count,
+                        buffer_type=DATA_BUFFER_TYPES.INPUT,
+                        slot=slot)
+
+                    # STEP 2. get data from INPUT buffer
+                    # NOTE the data is a view to the slot, therefore the step is
+                    # marked as consumed only after the data is translated
+                    raw_data = self.__get_data(buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                               slot=slot)
+                    # NOTE the receivers might have grouped the spike events by
+                    # neuron already, see BufferManager.set_spike_index
+                    spike_index = self._data_buffer_manager.get_spike_index(slot)
+
+                    # STEP 3. translate the data
+                    # NOTE the results are gathered to only the root_transformer_rank,
+                    # unless every transformer puts its own part of the results
+                    self._logger.debug("translating the data")
+                    translated_data = self._translator.translate(
+                        self._translation_function_id,
+                        self._translation_function,
+                        count,
+                        raw_data,
+                        self._transformer_intra_comm,
+                        self._translated_root_rank,
+                        spike_index=spike_index)
+
+                # STEP 4. mark the step as consumed, so that the slot can be
+                # refilled as soon as all transformers are done with it
+                self._data_buffer_manager.set_consumer_progress(
+                    consumer=self._consumer_index,
+                    step=count,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT)
                 
-                # STEP 4. send the translated data to Senders group
-                if self._sender_group_ranks and self._intra_comm.Get_rank() == self._root_transformer_rank:
-                    self._intra_comm.send(translated_data,
-                                          self._root_sending_rank,
-                                          tag=0)
-                # wait until root transformer rank sends the data
-                self._logger.debug("waiting for root to finish with sending")
-                self._transformer_intra_comm.Barrier()
+                # STEP 5. put the translated data into the OUTPUT buffer to be
+                # sent by Senders group
+                # Case a, every transformer puts its part of the spike trains
+                if self._sender_group_ranks and self._translator.distributed_output and \
+                        self._translation_function_id == TRANSLATION_FUNCTION_ID.RATE_TO_SPIKES:
+                    output_slot = self._data_buffer_manager.get_slot_index(
+                        count, DATA_BUFFER_TYPES.OUTPUT)
+                    # wait until the Senders group is done with the slot
+                    self._data_buffer_manager.wait_until_slot_free(
+                        step=count,
+                        buffer_type=DATA_BUFFER_TYPES.OUTPUT)
+                    data_start_index = self.__put_partial_spike_trains(translated_data,
+                                                                       DATA_BUFFER_TYPES.OUTPUT,
+                                                                       output_slot)
+                    if data_start_index is None:
+                        # NOTE a specific error is already logged
+                        self.__abort_output(count, output_slot)
+                        return Response.ERROR
+                    # the last transformer done with the slot publishes it
+                    if self._data_buffer_manager.mark_range_filled(
+                            number_of_producers=self._transformer_intra_comm.Get_size(),
+                            buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                            slot=output_slot):
+                        data_end_index = data_start_index + self._data_buffer_manager.get_filled_size(
+                            buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                            slot=output_slot)
+                        self._data_buffer_manager.reset_fill_counters(
+                            buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                            slot=output_slot)
+                        self.__publish_output(count, data_end_index, output_slot)
+
+                # Case b, the root transformer puts the gathered data
+                elif self._sender_group_ranks and self._intra_comm.Get_rank() == self._root_transformer_rank:
+                    output_slot = self._data_buffer_manager.get_slot_index(
+                        count, DATA_BUFFER_TYPES.OUTPUT)
+                    # wait until the Senders group is done with the slot
+                    self._data_buffer_manager.wait_until_slot_free(
+                        step=count,
+                        buffer_type=DATA_BUFFER_TYPES.OUTPUT)
+                    data_end_index = self.__put_data(translated_data,
+                                                     DATA_BUFFER_TYPES.OUTPUT,
+                                                     output_slot)
+                    if data_end_index is None:
+                        # NOTE a specific error is already logged
+                        self.__abort_output(count, output_slot)
+                        return Response.ERROR
+                    self.__publish_output(count, data_end_index, output_slot)
 
                 # continue next iteration
                 count += 1
@@ -176,4 +596,4 @@ class TransformerCommunicator:
                 info_log_message(self._transformer_intra_comm.Get_rank(),
                                  self._logger,
                                  'concluding transformation')
-                return Response.OK
\ No newline at end of file
+                return Response.OK
@@ -12,7 +12,6 @@
 #
 # ------------------------------------------------------------------------------ 
 from mpi4py import MPI
-import time
 import numpy as np
 
 from EBRAINS_InterscaleHUB.communicators.base_communicator import BaseCommunicator
@@ -35,7 +34,8 @@ class TVBCommunicator(BaseCommunicator):
                  sender_inter_comm,
                  sender_group_ranks,
                  receiver_group_ranks,
-                 root_transformer_rank):
+                 root_transformer_rank,
+                 persistent_requests=False):
        
         # initialize the common settings such as logger, data buffer, etc.
         super().__init__(configurations_manager,
@@ -49,83 +49,301 @@ class TVBCommunicator(BaseCommunicator):
                          receiver_group_ranks,
                          root_transformer_rank
                          )
+        # NOTE if set, the messages of the fixed-shape exchange with TVB are
+        # set up once as persistent requests with preallocated typed buffers
+        # and (re)started every step. It requires the buffer based (i.e. not
+        # pickled) counterpart in the TVB MPI wrapper.
+        self.__persistent_requests = persistent_requests
+        self.__requests = {}
+        # NOTE if TVB runs on several MPI ranks, each TVB rank owns a slice
+        # of the regions, the number of values per TVB rank is fixed per run
+        self.__region_slice_sizes = None
         
         interscalehub_utils.info_log_message(rank=self._my_rank,
                                              logger=self._logger,
                                              msg="Initialized")
 
+    def __get_request(self, key, shape, create_request):
+        """
+        returns the persistent request with the given key, it is (re)created
+        if it does not exist yet or if the shape of its message changed
+        """
+        cached_shape, request = self.__requests.get(key, (None, None))
+        if request is None or cached_shape != shape:
+            if request is not None:
+                request.Free()
+            request = create_request()
+            self.__requests[key] = (shape, request)
+        return request
+
+    def __free_requests(self):
+        """frees the persistent requests"""
+        for _, request in self.__requests.values():
+            request.Free()
+        self.__requests = {}
+
+    def __send_ready(self, ready):
+        """sends the ready status to all TVB ranks (see TVB MPI wrapper)"""
+        if not self.__persistent_requests:
+            requests=[]
+            for rank in range(self._num_sending):
+                requests.append(self._receiver_inter_comm.isend(True,dest=rank,tag=0))
+            MPI.Request.Waitall(requests)
+            return
+        requests = [self.__get_request(('ready', rank), None,
+                                       lambda rank=rank: self._receiver_inter_comm.Send_init(
+                                           [ready, MPI.BOOL], dest=rank, tag=0))
+                    for rank in range(self._num_sending)]
+        MPI.Prequest.Startall(requests)
+        MPI.Request.Waitall(requests)
+
+    def __receive_into(self, key, data_buffer, mpi_datatype, source, tag, status):
+        """receives a message from TVB into the given buffer"""
+        if not self.__persistent_requests:
+            self._receiver_inter_comm.Recv([data_buffer, mpi_datatype], source=source, tag=tag, status=status)
+            return
+        request = self.__get_request(key, data_buffer.shape,
+                                     lambda: self._receiver_inter_comm.Recv_init(
+                                         [data_buffer, mpi_datatype], source=source, tag=tag))
+        request.Start()
+        request.Wait(status)
+
+    def __send_from(self, key, data_buffer, mpi_datatype, dest):
+        """sends the given buffer to TVB"""
+        if not self.__persistent_requests:
+            self._sender_inter_comm.Send([data_buffer, mpi_datatype], dest=dest, tag=0)
+            return
+        request = self.__get_request(key, data_buffer.shape,
+                                     lambda: self._sender_inter_comm.Send_init(
+                                         [data_buffer, mpi_datatype], dest=dest, tag=0))
+        request.Start()
+        request.Wait()
+
+    def __receive_status(self, check, source, status):
+        """receives the current status of the simulation from TVB"""
+        if not self.__persistent_requests:
+            req = self._sender_inter_comm.irecv(source=source,tag=MPI.ANY_TAG)
+            req.wait(status)
+            return
+        request = self.__get_request('status', None,
+                                     lambda: self._sender_inter_comm.Recv_init(
+                                         [check, MPI.INT], source=source, tag=MPI.ANY_TAG))
+        request.Start()
+        request.Wait(status)
+
+    def __displacements(self, counts):
+        """displacements of the blocks of given counts in a contiguous buffer"""
+        displacements = np.zeros(counts.shape[0], dtype='i')
+        np.cumsum(counts[:-1], out=displacements[1:])
+        return displacements
+
+    def __get_receive_buffer(self, slot, size):
+        """
+        returns the buffer to receive the rates into, they start from the
+        index 2 of the slot
+
+        NOTE the overflow is detected before receiving, the rates which do
+        not fit into the slot are received into the overflow region instead
+
+        Returns
+        ------
+            the buffer, and True if it is the overflow region
+        """
+        capacity = self._data_buffer_manager.get_capacity(DATA_BUFFER_TYPES.INPUT)
+        # Case a, the rates fit into the slot
+        if 2 + size <= capacity:
+            self._data_buffer_manager.clear_overflow_region(producer=0,
+                                                            buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                            slot=slot)
+            return self._data_buffer_manager.get_from_range(start=2,
+                                                            end=2+size,
+                                                            buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                            slot=slot), False
+        # Case b, the rates overflow the slot
+        return self._data_buffer_manager.get_overflow_buffer(producer=0,
+                                                             start=2,
+                                                             end=2+size,
+                                                             buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                             slot=slot), True
+
+    def __receive_from_single_rank(self, slot, size, status_tvb):
+        """
+        receives the size and the rates from the TVB rank which sent the time
+        step into the given slot of the INPUT buffer
+        """
+        # 2) Get the size/shape of the data
+        source = status_tvb.Get_source()
+        self.__receive_into(('size', source), size, MPI.INT,
+                            source=source, tag=0, status=status_tvb)
+        
+        # 3) receive data
+        # data buffer to receive the data
+        # NOTE the number of regions is fixed per run, so the view
+        # (and the persistent request) per slot stays the same
+        data_buffer, is_overflowing = self.__get_receive_buffer(slot, int(size[0]))
+        self.__receive_into(('data', slot, source, is_overflowing), data_buffer, MPI.DOUBLE,
+                            source=source, tag=0, status=status_tvb)
+
+    def __gather_region_slices(self, slot):
+        """
+        gathers the rates of the region slices of all TVB ranks into the
+        given slot of the INPUT buffer, in order of the TVB ranks
+
+        NOTE the hub is the root of the collectives on the INTER communicator
+
+        Returns
+        ------
+            the number of values received
+        """
+        # 1) the number of values of each TVB rank
+        sizes = np.empty(self._num_sending, dtype='i')
+        self._receiver_inter_comm.Gather(None, [sizes, MPI.INT], root=MPI.ROOT)
+        # 2) the values of each TVB rank at its offset
+        size = int(sizes.sum())
+        data_buffer, _ = self.__get_receive_buffer(slot, size)
+        self._receiver_inter_comm.Gatherv(None,
+                                          [data_buffer, (sizes, self.__displacements(sizes)), MPI.DOUBLE],
+                                          root=MPI.ROOT)
+        return size
+
+    def __send_to_single_rank(self, slot, times, data, size, dest):
+        """sends the time step, the size and the rates to the given TVB rank"""
+        # NOTE the following 3 MPI calls are matching the protocol of
+        # TVB MPI Wrapper
+
+        # i) send the (start and end) time of simulation step
+        self.__send_from(('times', slot, dest), times, MPI.DOUBLE, dest)
+        
+        # ii)send the size of the data
+        size[0] = data.shape[0]
+        self.__send_from(('size', dest), size, MPI.INT, dest)
+        
+        # iii) send the data
+        self.__send_from(('data', slot, dest), data, MPI.DOUBLE, dest)
+
+    def __scatter_region_slices(self, times, data):
+        """
+        scatters the rates to the TVB ranks as per the region slices they own
+
+        NOTE the hub is the root of the collectives on the INTER communicator
+
+        Returns
+        ------
+            Response.OK, or Response.ERROR if the region slices do not match
+            the data
+        """
+        # the number of values each TVB rank expects, fixed per run
+        if self.__region_slice_sizes is None:
+            self.__region_slice_sizes = np.empty(self._num_receiving, dtype='i')
+            self._sender_inter_comm.Gather(None, [self.__region_slice_sizes, MPI.INT], root=MPI.ROOT)
+        if self.__region_slice_sizes.sum() != data.shape[0]:
+            self._logger.error(f"region slices of size: {self.__region_slice_sizes.sum()} "
+                               f"do not match data of size: {data.shape[0]}")
+            return Response.ERROR
+        # i) the (start and end) time of simulation step to all TVB ranks
+        self._sender_inter_comm.Bcast([times, MPI.DOUBLE], root=MPI.ROOT)
+        # ii) the region slice of each TVB rank
+        self._sender_inter_comm.Scatterv([data,
+                                          (self.__region_slice_sizes,
+                                           self.__displacements(self.__region_slice_sizes)),
+                                          MPI.DOUBLE],
+                                         None,
+                                         root=MPI.ROOT)
+        return Response.OK
+
     def receive(self):
         '''
-            Receives data from TVB on rank 0 and puts it into the INPUT buffer.
+            Receives data from TVB and puts it into the INPUT buffer.
+
+            NOTE if TVB runs on several MPI ranks, the TVB rank 0 sends the
+            time step and the status of the simulation, and the rates of the
+            region slices of all TVB ranks are gathered.
         '''
         size = np.empty(1, dtype='i') # size of the rate-array
+        ready = np.array(True, dtype='b')
+        # NOTE the time step is received outside of the INPUT buffer, because
+        # the slot might still be in use by the transformers at this point
+        simulation_step = np.empty(2, dtype='d')
+        step = 0
         status_tvb = MPI.Status()
         self._num_sending = self._receiver_inter_comm.Get_remote_size()
         self._logger.info("start receiving from TVB")
         while True:
             # send ready status to TVB (see TVB MPI wrapper)
-            requests=[]
-            for rank in range(self._num_sending):
-                requests.append(self._receiver_inter_comm.isend(True,dest=rank,tag=0))
-            MPI.Request.Waitall(requests)
+            self.__send_ready(ready)
 
             # NOTE the following 3 MPI calls are matching the protocol of
             # TVB MPI wrapper
 
             # 1) get the starting and ending time of the simulation step, and
             # current stauts of simulation
-            simulation_step = self._data_buffer_manager.get_from_range(
-                    start=0,
-                    end=2,
-                    buffer_type=DATA_BUFFER_TYPES.INPUT)
-            self._receiver_inter_comm.Recv([simulation_step, MPI.DOUBLE], source=0, tag=MPI.ANY_TAG, status=status_tvb)
+            self.__receive_into('time_step', simulation_step, MPI.DOUBLE,
+                                source=0, tag=MPI.ANY_TAG, status=status_tvb)
 
             # Test, check the current status of simulation
             # Case a, simulation is still running
             if status_tvb.Get_tag() == 0:
-                # wait until Transformer communciator set the buffer state
-            
-                # NOTE consider using MPI, remove the sleep and refactor
-                # while loop to something more efficient            
-                while self._data_buffer_manager.get_at(
-                    index=-1, buffer_type=DATA_BUFFER_TYPES.INPUT) != DATA_BUFFER_STATES.READY_TO_RECEIVE:
-                    time.sleep(0.001)
-                    continue
-
-                # 2) Get the size/shape of the data
-                self._receiver_inter_comm.Recv([size, 1, MPI.INT], source=status_tvb.Get_source(), tag=0, status=status_tvb)
-                
-                # 3) receive data
-                # data buffer to receive the data
-                simulation_step = self._data_buffer_manager.get_from(starting_index=2,
-                                                                 buffer_type=DATA_BUFFER_TYPES.INPUT)
-                self._receiver_inter_comm.Recv([simulation_step, MPI.DOUBLE], source=status_tvb.Get_source(), tag=0, status=status_tvb)
-                # set the header (i.e. the last index where the data ends)
+                # wait until all transformers are done with the slot
+                slot = self._data_buffer_manager.get_slot_index(
+                    step, DATA_BUFFER_TYPES.INPUT)
+                self._data_buffer_manager.wait_until_slot_free(
+                    step=step,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT)
+
+                # copy the time step to the first two indices of the slot
+                self._data_buffer_manager.get_from_range(
+                    start=0,
+                    end=2,
+                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                    slot=slot)[:] = simulation_step
+
+                # Case a.1, TVB runs on several MPI ranks
+                if self._num_sending > 1:
+                    # 2) and 3) gather the rates of all region slices
+                    size[0] = self.__gather_region_slices(slot)
+
+                # Case a.2, TVB runs on a single MPI rank
+                else:
+                    self.__receive_from_single_rank(slot, size, status_tvb)
+
+                # set the length (i.e. the last index where the data ends)
                 # NOTE because the first two values are always the time steps,
                 # and the data starts from index 2, so increase the size by 2
-                raw_data_end_index = size+2
-                self._data_buffer_manager.set_header_at(index=-2,
-                                                    header=raw_data_end_index,
-                                                    buffer_type=DATA_BUFFER_TYPES.INPUT)
+                raw_data_end_index = size[0]+2
+                self._data_buffer_manager.set_data_length(length=raw_data_end_index,
+                                                          buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                          slot=slot)
                 
                 # Mark as 'ready to do analysis/transformation'
-                self._data_buffer_manager.set_ready_state_at(index=-1,
-                                                            state=DATA_BUFFER_STATES.READY_TO_TRANSFORM,
-                                                            buffer_type=DATA_BUFFER_TYPES.INPUT)
+                self._data_buffer_manager.set_state(state=DATA_BUFFER_STATES.READY_TO_TRANSFORM,
+                                                    buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                    slot=slot)
+                # publish the slot by setting the step the data belongs to
+                # NOTE the sequence number must be set at last
+                self._data_buffer_manager.set_sequence_number(sequence_number=step,
+                                                              buffer_type=DATA_BUFFER_TYPES.INPUT,
+                                                              slot=slot)
 
                 # continue next iteration
+                step += 1
                 continue
             
             # Case b, simulation is ended
             elif status_tvb.Get_tag() == 1:
+                self.__free_requests()
                 # everything goes fine, terminate the loop and respond with OK
                 self._logger.info('TVB_to_NEST: End of receive function')
                 return Response.OK
 
             # Case c, A 'bad' MPI tag is received
             else:
+                # NOTE no more data is put into the INPUT buffer, so the
+                # transformers are signalled to terminate
+                self._data_buffer_manager.announce_termination()
+                self.__free_requests()
                 # log the exception with traceback
                 interscalehub_utils.log_exception(
+                    logger=self._logger,
                     log_message="bad mpi tag :",
                     mpi_tag_received=status_tvb.Get_tag())
                 # terminate with Error
@@ -134,15 +352,24 @@ class TVBCommunicator(BaseCommunicator):
     def send(self):
         '''
             Sends data to TVB
+
+            NOTE if TVB runs on several MPI ranks, the TVB rank 0 sends the
+            status of the simulation, and the rates are scattered to the TVB
+            ranks as per the region slices they own.
         '''
         status_tvb = MPI.Status()
-        status_transformer = MPI.Status()
         check = np.empty(1,dtype='i')
+        size = np.empty(1, dtype='i')  # size of the rate-array
         root_sending_rank = self._group_of_ranks_for_sending[0]
+        self._num_receiving = self._sender_inter_comm.Get_remote_size()
+        status_source = MPI.ANY_SOURCE if self._num_receiving == 1 else 0
+        # NOTE the translated data of each step is in the next slot of the
+        # ring of OUTPUT buffer slots
+        step = 0
         while True:
             # get the current status of the simulation
-            req = self._sender_inter_comm.irecv(source=MPI.ANY_SOURCE,tag=MPI.ANY_TAG)
-            req.wait(status_tvb)  # wait until TVB is ready to receive
+            # NOTE wait until TVB is ready to receive
+            self.__receive_status(check, status_source, status_tvb)
 
             # Test, check the current status of simulation
             # Case a, simualtion is still running
@@ -150,34 +377,69 @@ class TVBCommunicator(BaseCommunicator):
                 # send tag (received from TVB) to transformers to let it determine
                 # if the simulaiton is still running
                 if self._intra_comm.Get_rank() == root_sending_rank:
-                    self._intra_comm.send(True, dest=self._root_transformer_rank, tag=0)
+                    self._data_buffer_manager.announce_step(step)
             
-                # wait to receive translated data from transformers
-                if self._intra_comm.Get_rank() == root_sending_rank:
-                    times, data = self._intra_comm.recv(source=self._root_transformer_rank, tag=0, status=status_transformer)
+                # wait until transformers put the translated data into the
+                # OUTPUT buffer
+                slot = self._data_buffer_manager.get_slot_index(
+                    step, DATA_BUFFER_TYPES.OUTPUT)
+                self._data_buffer_manager.wait_until_sequence_number(
+                    sequence_number=step,
+                    buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                    slot=slot)
+                if self._data_buffer_manager.get_state(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                       slot=slot) == DATA_BUFFER_STATES.TERMINATE:
+                    # NOTE the transformers failed to translate the step, a
+                    # specific error is already logged by them
+                    self._logger.error(f"no translated data for step: {step}")
+                    self.__free_requests()
+                    return Response.ERROR
+                # NOTE the layout is (start time, end time, rates...), and the
+                # views are passed to MPI without copying
+                data_end_index = self._data_buffer_manager.get_data_length(buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                                           slot=slot)
+                times = self._data_buffer_manager.get_from_range(start=0,
+                                                                 end=2,
+                                                                 buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                                 slot=slot)
+                data = self._data_buffer_manager.get_from_range(start=2,
+                                                                end=data_end_index,
+                                                                buffer_type=DATA_BUFFER_TYPES.OUTPUT,
+                                                                slot=slot)
 
                 # send the data to TVB
-                # NOTE the following 3 MPI calls are matching the protocol of
-                # TVB MPI Wrapper
+                # Case a.1, TVB runs on several MPI ranks
+                if self._num_receiving > 1:
+                    if self.__scatter_region_slices(times, data) == Response.ERROR:
+                        # NOTE the step is already announced, so the
+                        # transformers are signalled to terminate after it
+                        if self._intra_comm.Get_rank() == root_sending_rank:
+                            self._data_buffer_manager.announce_termination()
+                        self.__free_requests()
+                        # NOTE a specific error is already logged
+                        return Response.ERROR
 
-                # i) send the (start and end) time of simulation step
-                self._sender_inter_comm.Send([times, MPI.DOUBLE], dest=status_tvb.Get_source(), tag=0)
-                
-                # ii)send the size of the data
-                size = np.array(int(data.shape[0]),dtype='i')
-                self._sender_inter_comm.Send([size,MPI.INT], dest=status_tvb.Get_source(), tag=0)
-                
-                # iii) send the data
-                self._sender_inter_comm.Send([data,MPI.DOUBLE], dest=status_tvb.Get_source(), tag=0)
+                # Case a.2, TVB runs on a single MPI rank
+                else:
+                    self.__send_to_single_rank(slot, times, data, size, status_tvb.Get_source())
+
+                # mark the step as sent, so that the slot can receive the next
+                # translated data
+                self._data_buffer_manager.set_consumer_progress(
+                    consumer=self._group_of_ranks_for_sending.index(self._my_rank),
+                    step=step,
+                    buffer_type=DATA_BUFFER_TYPES.OUTPUT)
                 
                 # continue next iteration
+                step += 1
                 continue
             
             # Case b, simulation is ended
             elif status_tvb.Get_tag() == 1:
                 # send the current simulation staus to transformers
                 if self._intra_comm.Get_rank() == root_sending_rank:
-                    self._intra_comm.send(False, dest=self._root_transformer_rank, tag=0)
+                    self._data_buffer_manager.announce_termination()
+                self.__free_requests()
                 # everything goes fine, terminate the loop and respond with OK
                 return Response.OK
             
@@ -185,9 +447,11 @@ class TVBCommunicator(BaseCommunicator):
             else:
                 # send the current simulation staus to transformers
                 if self._intra_comm.Get_rank() == root_sending_rank:
-                    self._intra_comm.send(False, dest=self._root_transformer_rank, tag=0)
+                    self._data_buffer_manager.announce_termination()
+                self.__free_requests()
                 # log the exception with traceback
                 interscalehub_utils.log_exception(
+                    logger=self._logger,
                     log_message="bad mpi tag :",
                     mpi_tag_received=status_tvb.Get_tag())
                 # terminate with Error
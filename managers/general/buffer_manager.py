@@ -11,13 +11,29 @@
 # Laboratory: Simulation Laboratory Neuroscience
 # Team: Multi-scale Simulation and Design
 # ------------------------------------------------------------------------------
+import time
+
 from mpi4py import MPI
 import numpy as np
 
-from EBRAINS_InterscaleHUB.common.interscalehub_enums import  DATA_BUFFER_TYPES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import  DATA_BUFFER_TYPES, DATA_BUFFER_STATES, BUFFER_WAIT_MODES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import CONTROL_BLOCK_FIELDS, DATA_BUFFER_HEADER_FIELDS
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import OVERFLOW_REGION_FIELDS, NUMA_PLACEMENTS
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import SOURCE_MARKER_FIELDS
+from EBRAINS_InterscaleHUB.managers.general.buffer_state_waiter import BufferStateWaiter, WaitLatencyHistogram
+from EBRAINS_InterscaleHUB.managers.general.memory_placement import MemoryPlacement
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
 
 
+# NOTE increase the version whenever the layout of the slots changes
+DATA_BUFFER_LAYOUT_VERSION = 1
+# alignment of the headers and the payloads in the slots, in number of
+# doubles i.e. 64 bytes
+DATA_BUFFER_ALIGNMENT = 8
+# size of the header of a slot, in number of doubles
+DATA_BUFFER_HEADER_SIZE = DATA_BUFFER_ALIGNMENT
+
+
 class MetaInterscaleHubBuffer(type):
     """This metaclass ensures there exists only one instance of
     InterscaleHubBuffer class. It prevents the side-effects such as
@@ -44,58 +60,724 @@ class BufferManager(metaclass=MetaInterscaleHubBuffer):
                     target_directory=DefaultDirectories.SIMULATION_RESULTS)
         
         self.__databuffer_input = None
+        self.__databuffer_output = None
+        # NOTE the buffers are split into a ring of equally sized slots so
+        # that e.g. the receiver can fill the next slot while the transformers
+        # are still working on the current one
+        self.__databuffer_slots = {DATA_BUFFER_TYPES.INPUT: [],
+                                   DATA_BUFFER_TYPES.OUTPUT: [],
+                                   DATA_BUFFER_TYPES.INDEX: []}
+        # typed headers of the slots, see DATA_BUFFER_HEADER_FIELDS
+        self.__databuffer_headers = {DATA_BUFFER_TYPES.INPUT: [],
+                                     DATA_BUFFER_TYPES.OUTPUT: [],
+                                     DATA_BUFFER_TYPES.INDEX: []}
+        # time from filling a slot to publishing it, and from publishing a
+        # slot to the consumer picking it up
+        self.__fill_times = {}
+        self.__publish_latencies = {}
+        # progress counters of the consumers of the buffers
+        self.__consumer_progress = {}
+        # fill counters of the producers of the buffers and their windows
+        # for the atomic operations
+        self.__fill_counters = {}
+        self.__fill_counter_windows = {}
+        # overflow regions of the producers for the data which does not fit
+        # into a slot, see create_mpi_overflow_regions
+        self.__overflow_tables = {}
+        self.__overflow_windows = {}
+        self.__overflow_buffers = {}
+        self.__overflow_copies = {}
+        # completion markers of the sources of the slots, see
+        # create_mpi_shared_memory_source_markers
+        self.__source_markers = {}
+        self.__first_sources = {}
+        # largest number of data points in a slot, and number of slots
+        # which overflowed
+        self.__high_water_marks = {}
+        self.__overflow_counts = {}
+        # control block e.g. to signal the simulation status to transformers
+        self.__control_block = None
+        self.__mpi_windows = []
+        # waits for the buffer state changes
+        self.__state_waiter = BufferStateWaiter()
+        # placement of the buffers on the NUMA nodes, see set_memory_placement
+        self.__memory_placement = MemoryPlacement()
+        self.__numa_placement = NUMA_PLACEMENTS.DEFAULT
+        self.__huge_pages = False
         self.__logger.debug("initialized")
 
     @property
     def databuffer_input(self): return self.__databuffer_input
 
-    def get_buffer(self, buffer_type):
-        if buffer_type == DATA_BUFFER_TYPES.INPUT:
-            return self.databuffer_input
-        # elif buffer_type == DATA_BUFFER_TYPES.OUTPUT:
-        #     return self.databuffer_output
+    @property
+    def databuffer_output(self): return self.__databuffer_output
+
+    def get_buffer(self, buffer_type, slot=0):
+        """returns the payload of the slot"""
+        if buffer_type in self.__databuffer_slots:
+            return self.__databuffer_slots[buffer_type][slot]
+        else:
+            self.__terminate_with_error(f"unknown data buffer type. {buffer_type}")
+
+    def get_header(self, buffer_type, slot=0):
+        """returns the header of the slot, see DATA_BUFFER_HEADER_FIELDS"""
+        if buffer_type in self.__databuffer_headers:
+            return self.__databuffer_headers[buffer_type][slot]
+        else:
+            self.__terminate_with_error(f"unknown data buffer type. {buffer_type}")
+
+    def get_number_of_slots(self, buffer_type):
+        """returns the number of slots in the ring of the given buffer type"""
+        if buffer_type in self.__databuffer_slots:
+            return len(self.__databuffer_slots[buffer_type])
         else:
             self.__terminate_with_error(f"unknown data buffer type. {buffer_type}")
 
-    # NOTE be careful to not to include the HEADER and READY indecies when
-    # specifying the indices to fetch the data
-    # TODO fix the HEADER and READY flags to specific indexes e.g. first two indecies
-    def set_ready_state_at(self, index, state, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
-        shared_memory_buffer[index] = state
+    def set_wait_mode(self, wait_mode):
+        """
+        sets the mode of waiting for the buffer state changes
+
+        Parameters
+        ----------
+        wait_mode: BUFFER_WAIT_MODES or str
+            the mode or the name of the mode e.g. 'ADAPTIVE'
+        """
+        if isinstance(wait_mode, str):
+            wait_mode = BUFFER_WAIT_MODES[wait_mode.upper()]
+        self.__state_waiter = BufferStateWaiter(BUFFER_WAIT_MODES(wait_mode))
+        self.__logger.debug(f"buffer wait mode: {self.__state_waiter.wait_mode.name}")
+
+    def set_memory_placement(self, numa_placement, huge_pages=False):
+        """
+        sets the placement of the buffers created afterwards
+
+        Parameters
+        ----------
+        numa_placement: NUMA_PLACEMENTS or str
+            the placement or the name of the placement e.g. 'INTERLEAVE'
+
+        huge_pages: bool
+            if set, the buffers are backed by (transparent) huge pages
+        """
+        if isinstance(numa_placement, str):
+            numa_placement = NUMA_PLACEMENTS[numa_placement.upper()]
+        self.__numa_placement = NUMA_PLACEMENTS(numa_placement)
+        self.__huge_pages = bool(huge_pages)
+
+    def wait_until_state(self, buffer_type, state, slot=0):
+        """blocks until the slot of the given buffer type is in given state"""
+        header = self.get_header(buffer_type, slot)
+        self.__state_waiter.wait(lambda: header[DATA_BUFFER_HEADER_FIELDS.STATE] == state,
+                                 (buffer_type, state))
+
+    def log_wait_latencies(self):
+        """logs the histograms of the time spent waiting for the buffer states"""
+        for key, histogram in self.__state_waiter.histograms.items():
+            if isinstance(key, tuple):
+                buffer_type, state = key
+                key = f"{buffer_type.name} buffer to be {state.name}"
+            self.__logger.info(f"waiting for {key} "
+                               f"({self.__state_waiter.wait_mode.name}): "
+                               f"{histogram.summary()}")
+        for buffer_type, histogram in self.__fill_times.items():
+            self.__logger.info(f"filling {buffer_type.name} buffer slots: "
+                               f"{histogram.summary()}")
+        for buffer_type, histogram in self.__publish_latencies.items():
+            self.__logger.info(f"{buffer_type.name} buffer slots from publishing "
+                               f"to consuming: {histogram.summary()}")
+
+    def log_buffer_usage(self):
+        """
+        logs the high-water marks of the buffers, so that the buffer sizes
+        can be chosen as per the real usage
+        """
+        for buffer_type, high_water_mark in self.__high_water_marks.items():
+            capacity = self.get_capacity(buffer_type)
+            self.__logger.info(f"{buffer_type.name} buffer high-water mark: "
+                               f"{high_water_mark} of {capacity} data points "
+                               f"({100.0 * high_water_mark / capacity:.1f}%), "
+                               f"slots overflowed: "
+                               f"{self.__overflow_counts.get(buffer_type, 0)}")
+
+    def get_capacity(self, buffer_type):
+        """
+        returns the number of data points a slot of the given buffer type can
+        hold
+        """
+        return self.get_buffer(buffer_type).shape[0]
+
+    def get_slot_index(self, step, buffer_type):
+        """returns the slot which holds the data of the given step"""
+        return step % self.get_number_of_slots(buffer_type)
+
+    # NOTE every slot has its own typed header (see DATA_BUFFER_HEADER_FIELDS)
+    # in front of its payload, the indices to fetch the data are relative to
+    # the payload
+    def set_state(self, state, buffer_type, slot=0):
+        """Sets the state of the slot, see DATA_BUFFER_STATES"""
+        self.get_header(buffer_type, slot)[DATA_BUFFER_HEADER_FIELDS.STATE] = state
+
+    def get_state(self, buffer_type, slot=0):
+        """Returns the state of the slot"""
+        return DATA_BUFFER_STATES(self.get_header(buffer_type, slot)[DATA_BUFFER_HEADER_FIELDS.STATE])
+
+    def set_data_length(self, length, buffer_type, slot=0):
+        """Sets the number of data points in the slot"""
+        self.get_header(buffer_type, slot)[DATA_BUFFER_HEADER_FIELDS.LENGTH] = length
+        self.__high_water_marks[buffer_type] = max(
+            length, self.__high_water_marks.get(buffer_type, 0))
+        if length > self.get_capacity(buffer_type):
+            self.__overflow_counts[buffer_type] = self.__overflow_counts.get(buffer_type, 0) + 1
 
-    def set_header_at(self, index, header, buffer_type):
-        """Sets header to the given value at a given index"""
-        shared_memory_buffer =  self.get_buffer(buffer_type)
-        shared_memory_buffer[index] = header
+    def get_data_length(self, buffer_type, slot=0):
+        """Returns the number of data points in the slot"""
+        return int(self.get_header(buffer_type, slot)[DATA_BUFFER_HEADER_FIELDS.LENGTH])
 
-    def set_custom_value_at(self, index, value, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
+    def set_sequence_number(self, sequence_number, buffer_type, slot=0):
+        """
+        Sets the sequence number (i.e. the step) of the data in the slot,
+        along with the time when it is published
+
+        NOTE it publishes the slot, so it must be set at last
+        """
+        header = self.get_header(buffer_type, slot)
+        if sequence_number >= 0:
+            header[DATA_BUFFER_HEADER_FIELDS.STEP] = sequence_number
+            header[DATA_BUFFER_HEADER_FIELDS.PRODUCER_END_TIMESTAMP] = time.time_ns()
+            self.__fill_times.setdefault(buffer_type, WaitLatencyHistogram()).record(
+                (header[DATA_BUFFER_HEADER_FIELDS.PRODUCER_END_TIMESTAMP] -
+                 header[DATA_BUFFER_HEADER_FIELDS.PRODUCER_START_TIMESTAMP]) * 1e-9)
+        header[DATA_BUFFER_HEADER_FIELDS.SEQUENCE_NUMBER] = sequence_number
+
+    def get_sequence_number(self, buffer_type, slot=0):
+        """Returns the sequence number (i.e. the step) of the data in the slot"""
+        return int(self.get_header(buffer_type, slot)[DATA_BUFFER_HEADER_FIELDS.SEQUENCE_NUMBER])
+
+    def set_spike_index(self, spike_event_offsets, spike_times, slot=0):
+        """
+        Puts the spike events of the slot of the INPUT buffer grouped by
+        neuron (CSR layout, see decode_spike_events) into the same slot of
+        the INDEX buffer
+
+        NOTE the layout is (number of neurons, offsets (as int64)...,
+        spike times...)
+
+        Returns
+        ------
+            True if the index fits into the slot, False otherwise
+        """
+        index_buffer = self.get_buffer(DATA_BUFFER_TYPES.INDEX, slot)
+        number_of_neurons = spike_event_offsets.shape[0] - 1
+        spike_times_start = number_of_neurons + 2
+        spike_times_end = spike_times_start + spike_times.shape[0]
+        if spike_times_end > index_buffer.shape[0]:
+            self.clear_spike_index(slot)
+            return False
+        index_buffer[0] = number_of_neurons
+        index_buffer[1:spike_times_start].view(np.int64)[:] = spike_event_offsets
+        index_buffer[spike_times_start:spike_times_end] = spike_times
+        self.set_data_length(spike_times_end, DATA_BUFFER_TYPES.INDEX, slot)
+        return True
+
+    def get_spike_index(self, slot=0):
+        """
+        Returns the spike event offsets and the spike times (views) of the
+        slot of the INDEX buffer, or None if the slot has no index
+        """
+        if not self.get_number_of_slots(DATA_BUFFER_TYPES.INDEX):
+            return None
+        spike_times_end = self.get_data_length(DATA_BUFFER_TYPES.INDEX, slot)
+        if not spike_times_end:
+            return None
+        index_buffer = self.get_buffer(DATA_BUFFER_TYPES.INDEX, slot)
+        spike_times_start = int(index_buffer[0]) + 2
+        return (index_buffer[1:spike_times_start].view(np.int64),
+                index_buffer[spike_times_start:spike_times_end])
+
+    def clear_spike_index(self, slot=0):
+        """marks that the slot has no index, if there is an INDEX buffer"""
+        if self.get_number_of_slots(DATA_BUFFER_TYPES.INDEX):
+            self.set_data_length(0, DATA_BUFFER_TYPES.INDEX, slot)
+
+    def set_custom_value_at(self, index, value, buffer_type, slot=0):
+        shared_memory_buffer =  self.get_buffer(buffer_type, slot)
         shared_memory_buffer[index] = value
 
-    def get_at(self, index, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
+    def get_at(self, index, buffer_type, slot=0):
+        shared_memory_buffer =  self.get_buffer(buffer_type, slot)
         return shared_memory_buffer[index]
 
-    def get_from(self, starting_index, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
+    def get_from(self, starting_index, buffer_type, slot=0):
+        shared_memory_buffer =  self.get_buffer(buffer_type, slot)
         return shared_memory_buffer[starting_index:]
 
-    def get_upto(self, end_index, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
+    def get_upto(self, end_index, buffer_type, slot=0):
+        shared_memory_buffer =  self.get_buffer(buffer_type, slot)
         return shared_memory_buffer[:end_index]
 
-    def get_from_range(self, start, end, buffer_type):
-        shared_memory_buffer =  self.get_buffer(buffer_type)
+    def get_from_range(self, start, end, buffer_type, slot=0):
+        shared_memory_buffer =  self.get_buffer(buffer_type, slot)
         return shared_memory_buffer[start:end]
 
-    def create_mpi_shared_memory_buffer(self, buffer_size, intra_comm, buffer_type):
+    def create_mpi_shared_memory_buffer(self, buffer_size, intra_comm,
+                                        buffer_type, number_of_slots=1,
+                                        first_touch_ranks=None):
+        """
+        Creates a ring of 'number_of_slots' slots in a single MPI shared memory
+        window. Each slot consists of a typed header (see
+        DATA_BUFFER_HEADER_FIELDS) followed by the payload which can hold
+        'buffer_size' data points.
+
+        NOTE the headers and the payloads are aligned to 64 bytes. The pages
+        are placed as per the memory placement (see set_memory_placement),
+        in case of FIRST_TOUCH by the given ranks (of intra_comm) which
+        consume the buffer.
+        """
+        if buffer_type not in self.__databuffer_slots:
+            self.__terminate_with_error("could not create shared memory buffer")
+
+        # round the payload up to the alignment
+        payload_size = -(-buffer_size // DATA_BUFFER_ALIGNMENT) * DATA_BUFFER_ALIGNMENT
+        slot_size = DATA_BUFFER_HEADER_SIZE + payload_size
+        self.__logger.debug(f"creating {buffer_type.name} buffer")
+        shared_memory_buffer, _ = self.__allocate_shared_memory(
+            slot_size * number_of_slots, MPI.DOUBLE, 'd', intra_comm)
+        # split the buffer into the headers and payloads of the slots (views,
+        # no copies)
+        slot_starts = [slot * slot_size for slot in range(number_of_slots)]
+        self.__databuffer_headers[buffer_type] = [
+            shared_memory_buffer[start:start + DATA_BUFFER_HEADER_SIZE].view(np.int64)
+            for start in slot_starts]
+        self.__databuffer_slots[buffer_type] = [
+            shared_memory_buffer[start + DATA_BUFFER_HEADER_SIZE:start + DATA_BUFFER_HEADER_SIZE + buffer_size]
+            for start in slot_starts]
+        # NOTE the pages are placed before they are touched for the first time
+        self.__place_buffer(shared_memory_buffer, intra_comm, buffer_type,
+                            first_touch_ranks)
+        if intra_comm.Get_rank() == 0:
+            for header in self.__databuffer_headers[buffer_type]:
+                header[:] = 0
+                header[DATA_BUFFER_HEADER_FIELDS.SEQUENCE_NUMBER] = -1
+                header[DATA_BUFFER_HEADER_FIELDS.LAYOUT_VERSION] = DATA_BUFFER_LAYOUT_VERSION
+
+        if buffer_type == DATA_BUFFER_TYPES.INPUT:
+            self.__databuffer_input = shared_memory_buffer
+        elif buffer_type == DATA_BUFFER_TYPES.OUTPUT:
+            self.__databuffer_output = shared_memory_buffer
+        # NOTE add here if more buffer types are needed to be created
+
+        self.__logger.debug(f"{buffer_type.name} buffer with {number_of_slots} "
+                            f"slots: {shared_memory_buffer}")
+        return shared_memory_buffer
+
+    def __place_buffer(self, shared_memory_buffer, intra_comm, buffer_type,
+                       first_touch_ranks):
+        """
+        places the pages of the buffer on the NUMA nodes as per the memory
+        placement, and reports the placement
+
+        NOTE the policies are set by rank 0, before any rank touches the
+        buffer
+        """
+        numa_placement = self.__numa_placement
+        if numa_placement == NUMA_PLACEMENTS.FIRST_TOUCH and not first_touch_ranks:
+            numa_placement = NUMA_PLACEMENTS.DEFAULT
+        my_rank = intra_comm.Get_rank()
+        payloads = self.__databuffer_slots[buffer_type]
+        number_of_numa_nodes = self.__memory_placement.get_number_of_numa_nodes()
+        is_placed = True
+        is_huge_pages = False
+        if my_rank == 0:
+            if self.__huge_pages:
+                is_huge_pages = self.__memory_placement.advise_huge_pages(shared_memory_buffer)
+            if numa_placement == NUMA_PLACEMENTS.INTERLEAVE:
+                is_placed = self.__memory_placement.interleave(shared_memory_buffer)
+            elif numa_placement == NUMA_PLACEMENTS.PER_SOCKET:
+                is_placed = all([self.__memory_placement.bind_to_node(payload, slot % number_of_numa_nodes)
+                                 for slot, payload in enumerate(payloads)])
+
+        if numa_placement == NUMA_PLACEMENTS.FIRST_TOUCH:
+            # wait until the policies are set
+            intra_comm.Barrier()
+            # every consumer touches its own chunk of every payload first
+            if my_rank in first_touch_ranks:
+                index = first_touch_ranks.index(my_rank)
+                number_of_chunks = len(first_touch_ranks)
+                for payload in payloads:
+                    size = payload.shape[0]
+                    payload[size * index // number_of_chunks:
+                            size * (index + 1) // number_of_chunks] = 0
+            # the headers are touched only after the payloads
+            intra_comm.Barrier()
+
+        if my_rank == 0:
+            placement_report = numa_placement.name
+            if numa_placement == NUMA_PLACEMENTS.FIRST_TOUCH:
+                placement_report += f" by ranks {first_touch_ranks}"
+            if not is_placed:
+                placement_report += " (libnuma is not available, placed by first touch of rank 0)"
+            huge_pages_report = "requested" if self.__huge_pages else "not requested"
+            if self.__huge_pages and not is_huge_pages:
+                huge_pages_report += " but not available"
+            self.__logger.info(f"{buffer_type.name} buffer placement: {placement_report}, "
+                               f"NUMA nodes: {number_of_numa_nodes}, "
+                               f"huge pages: {huge_pages_report}")
+
+    def create_mpi_shared_memory_consumer_progress(self, number_of_consumers,
+                                                   intra_comm, buffer_type):
+        """
+        Creates the progress counters of the consumers (e.g. transformers) of
+        the given buffer type in MPI shared memory. Each consumer sets its own
+        counter to the last step it is done with, so a slot can be refilled
+        without a global synchronization of the consumers.
+        """
+        self.__consumer_progress[buffer_type], _ = self.__allocate_shared_memory(
+            number_of_consumers, MPI.INT64_T, np.int64, intra_comm)
+        if intra_comm.Get_rank() == 0:
+            # NOTE no step is consumed yet
+            self.__consumer_progress[buffer_type][:] = -1
+        return self.__consumer_progress[buffer_type]
+
+    def set_consumer_progress(self, consumer, step, buffer_type):
+        """marks that the consumer is done with the data of the given step"""
+        self.__consumer_progress[buffer_type][consumer] = step
+
+    def wait_until_slot_free(self, step, buffer_type):
+        """
+        blocks until the slot of the given step can be (re)filled i.e. until
+        all consumers are done with the step which previously used the slot
+        """
+        previous_step = step - self.get_number_of_slots(buffer_type)
+        slot = self.get_slot_index(step, buffer_type)
+        # Case a, single consumer, it sets the slot state
+        if buffer_type not in self.__consumer_progress:
+            self.wait_until_state(buffer_type,
+                                  DATA_BUFFER_STATES.READY_TO_RECEIVE,
+                                  slot)
+        # Case b, multiple consumers
+        else:
+            consumer_progress = self.__consumer_progress[buffer_type]
+            self.__state_waiter.wait(lambda: consumer_progress.min() >= previous_step,
+                                     (buffer_type, DATA_BUFFER_STATES.READY_TO_RECEIVE))
+        # the producer starts filling the slot
+        self.get_header(buffer_type, slot)[
+            DATA_BUFFER_HEADER_FIELDS.PRODUCER_START_TIMESTAMP] = time.time_ns()
+
+    def create_mpi_shared_memory_fill_counters(self, intra_comm, buffer_type):
+        """
+        Creates the fill counters of the slots of the given buffer type in MPI
+        shared memory. The producers (e.g. receivers) reserve disjoint ranges
+        of a slot by atomically incrementing its fill offset, and count
+        themselves as done with the slot by atomically incrementing its
+        completion counter.
+
+        NOTE the layout is (fill offset of each slot...,
+        completion counter of each slot...)
+        """
+        number_of_slots = self.get_number_of_slots(buffer_type)
+        fill_counters, mpi_window = self.__allocate_shared_memory(
+            2 * number_of_slots, MPI.INT64_T, np.int64, intra_comm)
+        if intra_comm.Get_rank() == 0:
+            # NOTE nothing is filled yet
+            fill_counters[:] = 0
+        # NOTE passive target epoch for the atomic operations, it lasts as
+        # long as the window is used
+        mpi_window.Lock_all()
+        self.__fill_counters[buffer_type] = fill_counters
+        self.__fill_counter_windows[buffer_type] = mpi_window
+        return fill_counters
+
+    def reserve_range(self, size, buffer_type, slot=0):
+        """
+        atomically reserves a range of 'size' data points in the slot
+
+        Returns
+        ------
+            the index where the reserved range starts
+        """
+        return self.__fetch_and_add(size, buffer_type, slot)
+
+    def mark_range_filled(self, number_of_producers, buffer_type, slot=0):
+        """
+        counts the calling producer as done with filling the slot
+
+        Returns
+        ------
+            True if the calling producer is the last one to fill the slot
+        """
+        number_of_producers_done = self.__fetch_and_add(
+            1, buffer_type, self.get_number_of_slots(buffer_type) + slot) + 1
+        return number_of_producers_done == number_of_producers
+
+    def get_filled_size(self, buffer_type, slot=0):
+        """returns the number of data points reserved in the slot"""
+        return int(self.__fill_counters[buffer_type][slot])
+
+    def reset_fill_counters(self, buffer_type, slot=0):
+        """resets the fill offset and the completion counter of the slot"""
+        fill_counters = self.__fill_counters[buffer_type]
+        fill_counters[slot] = 0
+        fill_counters[self.get_number_of_slots(buffer_type) + slot] = 0
+        # make the reset visible to the other producers
+        self.__fill_counter_windows[buffer_type].Sync()
+
+    def __fetch_and_add(self, value, buffer_type, index):
+        """atomically adds the value to the fill counter at the given index
+        and returns its previous value"""
+        mpi_window = self.__fill_counter_windows[buffer_type]
+        value = np.array(value, dtype=np.int64)
+        previous_value = np.empty(1, dtype=np.int64)
+        # NOTE the counters are owned by rank 0 of the window
+        mpi_window.Fetch_and_op([value, MPI.INT64_T],
+                                [previous_value, MPI.INT64_T],
+                                target_rank=0,
+                                target_disp=index,
+                                op=MPI.SUM)
+        mpi_window.Flush(0)
+        return int(previous_value[0])
+
+    def create_mpi_overflow_regions(self, number_of_producers, intra_comm,
+                                    buffer_type):
+        """
+        Creates the overflow regions of the slots of the given buffer type.
+        If the data of a step does not fit into a slot, a producer (e.g.
+        receiver) puts its data which does not fit into its own overflow
+        region, and the consumers fetch it from there.
+
+        NOTE the overflow regions are private memory of the producers which
+        is attached to a dynamic MPI window, so that they can be grown without
+        a collective (re)allocation. The table of the regions is kept in MPI
+        shared memory, see OVERFLOW_REGION_FIELDS.
+        """
+        number_of_slots = self.get_number_of_slots(buffer_type)
+        number_of_fields = len(OVERFLOW_REGION_FIELDS)
+        overflow_table, _ = self.__allocate_shared_memory(
+            number_of_slots * number_of_producers * number_of_fields,
+            MPI.INT64_T, np.int64, intra_comm)
+        overflow_table = overflow_table.reshape(number_of_slots,
+                                                number_of_producers,
+                                                number_of_fields)
+        if intra_comm.Get_rank() == 0:
+            # NOTE no region is used yet
+            overflow_table[:] = -1
+        mpi_window = MPI.Win.Create_dynamic(comm=intra_comm)
+        # NOTE passive target epoch for fetching the regions, it lasts as
+        # long as the window is used
+        mpi_window.Lock_all()
+        self.__mpi_windows.append(mpi_window)
+        self.__overflow_tables[buffer_type] = overflow_table
+        self.__overflow_windows[buffer_type] = (mpi_window, intra_comm.Get_rank())
+        self.__overflow_buffers[buffer_type] = [None] * number_of_slots
+        return overflow_table
+
+    def get_overflow_buffer(self, producer, start, end, buffer_type, slot=0):
+        """
+        returns the overflow region of the calling producer for the data
+        points [start, end) of the slot, and publishes it to the consumers
+
+        NOTE it must only be called while the slot is free (i.e. at a step
+        boundary), because the region is reallocated if it is too small
+        """
+        size = end - start
+        mpi_window, my_rank = self.__overflow_windows[buffer_type]
+        overflow_buffer = self.__overflow_buffers[buffer_type][slot]
+        # Case a, the region is too small, grow it
+        if overflow_buffer is None or overflow_buffer.shape[0] < size:
+            if overflow_buffer is not None:
+                mpi_window.Detach(overflow_buffer)
+            # NOTE grow by half as much again, so that a slightly larger
+            # burst in the next steps does not reallocate it again
+            overflow_buffer = np.empty(size + size // 2, dtype='d')
+            mpi_window.Attach(overflow_buffer)
+            self.__overflow_buffers[buffer_type][slot] = overflow_buffer
+            self.__logger.info(f"{buffer_type.name} buffer slot {slot} "
+                               f"overflows by {size} data points, "
+                               f"overflow region grown to "
+                               f"{overflow_buffer.shape[0]} data points")
+        region = self.__overflow_tables[buffer_type][slot, producer]
+        region[OVERFLOW_REGION_FIELDS.OWNER] = my_rank
+        region[OVERFLOW_REGION_FIELDS.START] = start
+        region[OVERFLOW_REGION_FIELDS.ADDRESS] = MPI.Get_address(overflow_buffer)
+        region[OVERFLOW_REGION_FIELDS.END] = end
+        return overflow_buffer[:size]
+
+    def clear_overflow_region(self, producer, buffer_type, slot=0):
+        """marks that the calling producer does not overflow the slot"""
+        self.__overflow_tables[buffer_type][slot, producer] = -1
+
+    def get_data(self, buffer_type, slot=0):
+        """
+        returns the data in the slot
+
+        NOTE it is a view of the slot if the data fits into it, otherwise it
+        is a copy of the slot together with the overflow regions
+        """
+        length = self.get_data_length(buffer_type, slot)
+        capacity = self.get_capacity(buffer_type)
+        # Case a, the data fits into the slot
+        if length <= capacity:
+            return self.get_from_range(0, length, buffer_type, slot)
+
+        # Case b, the data overflows the slot
+        overflow_copy = self.__overflow_copies.get(buffer_type)
+        if overflow_copy is None or overflow_copy.shape[0] < length:
+            overflow_copy = np.empty(length, dtype='d')
+            self.__overflow_copies[buffer_type] = overflow_copy
+        data = overflow_copy[:length]
+        data[:capacity] = self.get_buffer(buffer_type, slot)
+        # NOTE the regions overwrite the (unused) end of the slot where the
+        # data of a producer does not fit
+        mpi_window, _ = self.__overflow_windows[buffer_type]
+        for region in self.__overflow_tables[buffer_type][slot]:
+            start = int(region[OVERFLOW_REGION_FIELDS.START])
+            end = int(region[OVERFLOW_REGION_FIELDS.END])
+            if end <= start:
+                continue
+            owner = int(region[OVERFLOW_REGION_FIELDS.OWNER])
+            mpi_window.Get([data[start:end], MPI.DOUBLE],
+                           owner,
+                           target=(int(region[OVERFLOW_REGION_FIELDS.ADDRESS]),
+                                   end - start,
+                                   MPI.DOUBLE))
+            mpi_window.Flush(owner)
+        return data
+
+    def create_mpi_shared_memory_source_markers(self, sources_per_producer,
+                                                intra_comm, buffer_type):
+        """
+        Creates the completion markers of the sources (e.g. NEST ranks) of the
+        slots of the given buffer type in MPI shared memory. A producer marks
+        the package of a source as soon as it is in the slot, so that the
+        consumers can start working on it before the whole slot is filled.
+
+        NOTE each producer (e.g. receiver) has its own sources, they are
+        numbered consecutively in the order of the producers, see
+        get_first_source. See SOURCE_MARKER_FIELDS for the fields.
+        """
+        first_sources = np.zeros(len(sources_per_producer) + 1, dtype=np.int64)
+        np.cumsum(sources_per_producer, out=first_sources[1:])
+        number_of_sources = int(first_sources[-1])
+        number_of_slots = self.get_number_of_slots(buffer_type)
+        number_of_fields = len(SOURCE_MARKER_FIELDS)
+        source_markers, _ = self.__allocate_shared_memory(
+            number_of_slots * number_of_sources * number_of_fields,
+            MPI.INT64_T, np.int64, intra_comm)
+        source_markers = source_markers.reshape(number_of_slots,
+                                                number_of_sources,
+                                                number_of_fields)
+        if intra_comm.Get_rank() == 0:
+            # NOTE no package is received yet
+            source_markers[:] = -1
+        self.__source_markers[buffer_type] = source_markers
+        self.__first_sources[buffer_type] = first_sources
+        return source_markers
+
+    def has_source_markers(self, buffer_type):
+        """returns True if the sources of the given buffer type are marked"""
+        return buffer_type in self.__source_markers
+
+    def get_number_of_sources(self, buffer_type):
+        """returns the number of sources of the given buffer type"""
+        return self.__source_markers[buffer_type].shape[1]
+
+    def get_first_source(self, producer, buffer_type):
+        """returns the number of the first source of the given producer"""
+        return int(self.__first_sources[buffer_type][producer])
+
+    def mark_source_received(self, source, start, end, step, buffer_type, slot=0):
+        """marks that the package [start, end) of the source of the given step is in the slot"""
+        source_marker = self.__source_markers[buffer_type][slot, source]
+        source_marker[SOURCE_MARKER_FIELDS.START] = start
+        source_marker[SOURCE_MARKER_FIELDS.END] = end
+        # NOTE the step must be set at last
+        source_marker[SOURCE_MARKER_FIELDS.STEP] = step
+
+    def get_source_range(self, source, buffer_type, slot=0):
+        """returns the (start, end) of the package of the source in the slot"""
+        source_marker = self.__source_markers[buffer_type][slot, source]
+        return (int(source_marker[SOURCE_MARKER_FIELDS.START]),
+                int(source_marker[SOURCE_MARKER_FIELDS.END]))
+
+    def wait_until_any_source_received(self, step, sources, buffer_type, slot=0):
+        """
+        blocks until the package of the given step of any of the given
+        sources is in the slot
+
+        Returns
+        ------
+            the source whose package is received
+        """
+        source_markers = self.__source_markers[buffer_type][slot]
+        received_sources = []
+
+        def is_any_source_received():
+            for source in sources:
+                if source_markers[source, SOURCE_MARKER_FIELDS.STEP] == step:
+                    received_sources.append(source)
+                    return True
+            return False
+
+        self.__state_waiter.wait(is_any_source_received,
+                                 f"{buffer_type.name} buffer source packages")
+        return received_sources[-1]
+
+    def create_mpi_shared_memory_control_block(self, intra_comm):
+        """
+        Creates the control block in MPI shared memory. It holds the number of
+        steps announced and the terminate flag (see CONTROL_BLOCK_FIELDS).
+        """
+        self.__control_block, _ = self.__allocate_shared_memory(
+            len(CONTROL_BLOCK_FIELDS), MPI.INT64_T, np.int64, intra_comm)
+        if intra_comm.Get_rank() == 0:
+            # NOTE no step is announced yet
+            self.__control_block[:] = 0
+        return self.__control_block
+
+    def announce_step(self, step):
+        """announces to the transformers that the simulation runs the given step"""
+        self.__control_block[CONTROL_BLOCK_FIELDS.STEP] = step + 1
+
+    def announce_termination(self):
+        """announces to the transformers that the simulation is finished"""
+        self.__control_block[CONTROL_BLOCK_FIELDS.TERMINATE] = 1
+
+    def wait_until_step_announced(self, step):
+        """
+        blocks until the given step is announced or the simulation is finished
+
+        Returns
+        ------
+            True if the step is announced, False if the simulation is finished
+        """
+        control_block = self.__control_block
+        self.__state_waiter.wait(
+            lambda: (control_block[CONTROL_BLOCK_FIELDS.STEP] > step or
+                     control_block[CONTROL_BLOCK_FIELDS.TERMINATE]),
+            "simulation status")
+        # NOTE the steps announced before the termination are still processed
+        return bool(control_block[CONTROL_BLOCK_FIELDS.STEP] > step)
+
+    def wait_until_sequence_number(self, sequence_number, buffer_type, slot=0):
+        """blocks until the data of the given step is published in the slot"""
+        header = self.get_header(buffer_type, slot)
+        self.__state_waiter.wait(
+            lambda: header[DATA_BUFFER_HEADER_FIELDS.SEQUENCE_NUMBER] == sequence_number,
+            (buffer_type, DATA_BUFFER_STATES.READY_TO_TRANSFORM))
+        self.__publish_latencies.setdefault(buffer_type, WaitLatencyHistogram()).record(
+            (time.time_ns() - header[DATA_BUFFER_HEADER_FIELDS.PRODUCER_END_TIMESTAMP]) * 1e-9)
+
+    def __allocate_shared_memory(self, number_of_elements, mpi_datatype, dtype,
+                                 intra_comm):
+        """
+        allocates an MPI shared memory window and returns a 1D numpy array
+        whose data points to it, and the window
+        """
         # set unit (data) size for the memory buffer
-        desired_data_size = MPI.DOUBLE.Get_size()
+        desired_data_size = mpi_datatype.Get_size()
         
         # Case a: if rank 0 then create the shared block
         if intra_comm.Get_rank() == 0:
-            buffer_bytes = desired_data_size * buffer_size
+            buffer_bytes = desired_data_size * number_of_elements
         # Case b: otherwise if rank 1-x then get a handle to it
         else:
             buffer_bytes = 0
@@ -103,6 +785,8 @@ class BufferManager(metaclass=MetaInterscaleHubBuffer):
         # create an MPI Window object that allocates memory
         self.__logger.debug("creating shared memory window")
         mpi_window = MPI.Win.Allocate_shared(buffer_bytes, desired_data_size, comm=intra_comm)
+        # NOTE keep a reference to the window as long as the buffer is used
+        self.__mpi_windows.append(mpi_window)
         # get the address for load/store access to window segment
         self.__logger.debug("getting buffer and data (unit) size")
         shared_buffer, actual_data_size = mpi_window.Shared_query(0)
@@ -116,21 +800,9 @@ class BufferManager(metaclass=MetaInterscaleHubBuffer):
         # Case b: everything went good,
         # now create a 1D numpy array (buffer) whose data points to the
         # shared memory
-
-        if buffer_type == DATA_BUFFER_TYPES.INPUT:
-            self.__logger.debug("creating input buffer")
-            self.__databuffer_input = np.ndarray(
-            buffer=shared_buffer,
-            dtype='d',
-            shape=(buffer_size,))
-            
-            self.__logger.debug(f"input buffer: {self.databuffer_input}")
-            return self.databuffer_input
-        
-        # NOTE add here if more buffer types are needed to be created
-        
-        else:
-            self.__terminate_with_error("could not create shared memory buffer")
+        return np.ndarray(buffer=shared_buffer,
+                          dtype=dtype,
+                          shape=(number_of_elements,)), mpi_window
         
     def __terminate_with_error(self, msg):
         try:
@@ -0,0 +1,127 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import os
+import time
+
+import numpy as np
+
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import BUFFER_WAIT_MODES
+
+
+class WaitLatencyHistogram:
+    """
+    Histogram of the time spent waiting for a buffer state change.
+    The bins are spaced by powers of two, starting from 1 microsecond i.e.
+    bin i counts the waits which took less than 2^i microseconds.
+    """
+    def __init__(self, number_of_bins=24):
+        self.__counts = np.zeros(number_of_bins, dtype=np.int64)
+        self.__total_time = 0.0
+        self.__max_time = 0.0
+
+    @property
+    def counts(self): return self.__counts
+
+    @property
+    def number_of_waits(self): return int(self.__counts.sum())
+
+    def record(self, elapsed_time):
+        """records a wait which took elapsed_time seconds"""
+        microseconds = elapsed_time * 1e6
+        bin_index = 0 if microseconds < 1.0 else int(np.log2(microseconds)) + 1
+        self.__counts[min(bin_index, self.__counts.shape[0] - 1)] += 1
+        self.__total_time += elapsed_time
+        self.__max_time = max(self.__max_time, elapsed_time)
+
+    def summary(self):
+        """returns the histogram as a human readable string"""
+        if not self.number_of_waits:
+            return "no waits recorded"
+        bins = ", ".join(f"<{2**i}us: {count}"
+                         for i, count in enumerate(self.__counts) if count)
+        return (f"waits: {self.number_of_waits}, "
+                f"mean: {self.__total_time / self.number_of_waits * 1e6:.1f}us, "
+                f"max: {self.__max_time * 1e6:.1f}us, histogram: [{bins}]")
+
+
+class BufferStateWaiter:
+    """
+    Waits until a buffer state changes, as per the chosen wait mode, and keeps
+    track of the waiting times.
+
+    NOTE the states are polled from the MPI shared memory, so the waiter works
+    between all ranks which share the buffer.
+    """
+    def __init__(self, wait_mode=BUFFER_WAIT_MODES.ADAPTIVE,
+                 spin_iterations=1000,
+                 yield_iterations=100,
+                 max_sleep_time=0.001):
+        self.__wait_mode = wait_mode
+        self.__spin_iterations = spin_iterations
+        self.__yield_iterations = yield_iterations
+        self.__max_sleep_time = max_sleep_time
+        self.__histograms = {}
+
+    @property
+    def wait_mode(self): return self.__wait_mode
+
+    @property
+    def histograms(self): return self.__histograms
+
+    def wait(self, is_ready, histogram_key):
+        """
+        blocks until is_ready() returns True
+
+        Parameters
+        ----------
+        is_ready: callable
+            returns True when the awaited state is reached
+
+        histogram_key: hashable
+            key of the histogram in which the waiting time is recorded
+        """
+        start_time = time.perf_counter()
+        if not is_ready():
+            if self.__wait_mode == BUFFER_WAIT_MODES.SPIN:
+                self.__spin(is_ready)
+            elif self.__wait_mode == BUFFER_WAIT_MODES.ADAPTIVE:
+                self.__adaptive(is_ready)
+            else:
+                self.__sleep(is_ready)
+        self.__histograms.setdefault(histogram_key, WaitLatencyHistogram()).record(
+            time.perf_counter() - start_time)
+
+    def __spin(self, is_ready):
+        """busy polling"""
+        while not is_ready():
+            continue
+
+    def __sleep(self, is_ready):
+        """poll and sleep in between"""
+        while not is_ready():
+            time.sleep(self.__max_sleep_time)
+
+    def __adaptive(self, is_ready):
+        """spin first, then yield the CPU, then sleep with exponential backoff"""
+        for _ in range(self.__spin_iterations):
+            if is_ready():
+                return
+        for _ in range(self.__yield_iterations):
+            if is_ready():
+                return
+            os.sched_yield()
+        sleep_time = 1e-6
+        while not is_ready():
+            time.sleep(sleep_time)
+            sleep_time = min(2 * sleep_time, self.__max_sleep_time)
@@ -0,0 +1,103 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import ctypes
+import ctypes.util
+import mmap
+
+
+# see madvise(2)
+MADV_HUGEPAGE = 14
+
+
+class MemoryPlacement:
+    """
+    Places the pages of (shared) memory on the NUMA nodes, and backs them
+    with (transparent) huge pages.
+
+    NOTE the placement is done with libnuma, if it is not available the
+    memory is placed by the first touch only. The policies must be set before
+    the memory is touched for the first time.
+    """
+    def __init__(self):
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.__libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+        self.__libnuma = None
+        libnuma_path = ctypes.util.find_library('numa')
+        if libnuma_path is None:
+            return
+        try:
+            libnuma = ctypes.CDLL(libnuma_path)
+        except OSError:
+            return
+        if libnuma.numa_available() < 0:
+            return
+        libnuma.numa_interleave_memory.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+        libnuma.numa_tonode_memory.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+        self.__libnuma = libnuma
+
+    @property
+    def is_numa_available(self): return self.__libnuma is not None
+
+    def get_number_of_numa_nodes(self):
+        """returns the number of NUMA nodes, 1 if libnuma is not available"""
+        if self.__libnuma is None:
+            return 1
+        return self.__libnuma.numa_num_configured_nodes()
+
+    def interleave(self, array):
+        """
+        interleaves the pages of the array over all NUMA nodes
+
+        Returns
+        ------
+            True if the policy is set, False otherwise
+        """
+        if self.__libnuma is None:
+            return False
+        start, size = self.__get_page_range(array)
+        all_nodes = ctypes.c_void_p.in_dll(self.__libnuma, 'numa_all_nodes_ptr')
+        self.__libnuma.numa_interleave_memory(start, size, all_nodes)
+        return True
+
+    def bind_to_node(self, array, node):
+        """
+        places the pages of the array on the given NUMA node
+
+        Returns
+        ------
+            True if the policy is set, False otherwise
+        """
+        if self.__libnuma is None:
+            return False
+        start, size = self.__get_page_range(array)
+        self.__libnuma.numa_tonode_memory(start, size, node)
+        return True
+
+    def advise_huge_pages(self, array):
+        """
+        advises the kernel to back the array with transparent huge pages
+
+        Returns
+        ------
+            True if the advice is taken, False otherwise
+        """
+        start, size = self.__get_page_range(array)
+        return self.__libc.madvise(start, size, MADV_HUGEPAGE) == 0
+
+    def __get_page_range(self, array):
+        """returns the start and the size of the pages which lie within the array"""
+        address = array.ctypes.data
+        start = -(-address // mmap.PAGESIZE) * mmap.PAGESIZE
+        end = (address + array.nbytes) // mmap.PAGESIZE * mmap.PAGESIZE
+        return start, max(end - start, 0)
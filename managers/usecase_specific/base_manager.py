@@ -20,6 +20,8 @@ from EBRAINS_RichEndpoint.application_companion.common_enums import INTERCOMM_TY
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_EXCHANGE_DIRECTION
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_BUFFER_TYPES
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_BUFFER_STATES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import BUFFER_WAIT_MODES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import NUMA_PLACEMENTS
 from EBRAINS_InterscaleHUB.common.interscalehub_utils import info_log_message, debug_log_message
 
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
@@ -37,7 +39,8 @@ class BaseManager(ABC):
                  buffer_size,
                  parameters,
                  sci_params,
-                 direction):
+                 direction,
+                 output_buffer_size=None):
         """
         Init params, setup mpi groups, create buffers, initialize default
         settings, data channel setup
@@ -80,12 +83,35 @@ class BaseManager(ABC):
         self._data_buffer_manager = BufferManager(
             self._configurations_manager,
             self._log_settings)
+        # NOTE the wait mode determines how the buffer state changes are
+        # awaited, see BUFFER_WAIT_MODES
+        self._data_buffer_manager.set_wait_mode(
+            getattr(self._sci_params, 'buffer_wait_mode',
+                    BUFFER_WAIT_MODES.ADAPTIVE))
+        # NOTE the placement determines on which NUMA nodes the pages of the
+        # buffers are, see NUMA_PLACEMENTS
+        self._data_buffer_manager.set_memory_placement(
+            getattr(self._sci_params, 'buffer_numa_placement',
+                    NUMA_PLACEMENTS.DEFAULT),
+            getattr(self._sci_params, 'buffer_huge_pages', False))
         self._interscalehub_buffer = None
         
         # 1.4) class variables
         # self._path = self._parameters['path']
         self._databuffer_input = None
+        self._databuffer_output = None
         self._buffer_size = buffer_size
+        # NOTE the OUTPUT buffer holds the translated data to be sent, its
+        # size defaults to the size of the INPUT buffer, unless the use case
+        # knows better
+        if output_buffer_size is None:
+            output_buffer_size = buffer_size
+        self._output_buffer_size = getattr(self._sci_params,
+                                           'output_buffer_size', output_buffer_size)
+        # NOTE the receivers fill the next slot of the INPUT buffer while the
+        # transformers are still working on the current one
+        self._number_of_buffer_slots = getattr(self._sci_params,
+                                               'number_of_buffer_slots', 2)
         # INTER = between applications
         self._receiver_inter_comm = None
         self._sender_inter_comm = None
@@ -93,6 +119,12 @@ class BaseManager(ABC):
         self._receiver_intra_comm = None
         self._sender_intra_comm = None
         self._transformer_intra_comm = None
+        # NOTE the buffers are shared within a node (shared memory domain),
+        # see _setup_node_comms
+        self._node_comm = None
+        self._node_ranks = None
+        self._node_transformer_ranks = None
+        self._relay_comm = None
         self._receiver_group_ranks = receiver_group_ranks
         self._sender_group_ranks = sender_group_ranks
         # NOTE all remaining ranks are transformers
@@ -104,16 +136,78 @@ class BaseManager(ABC):
                          self._logger,
                          "STEP 2: setting up mpi groups...")
         self._setup_mpi_groups_and_comms()
+        self._setup_node_comms()
 
         # STEP 3) create buffers
         info_log_message(self._my_rank,
                          self._logger,
                          "STEP 3: Creating MPI shared memory Buffer...")
         #  3.1) create input buffer
-        # NOTE more buffer types (e.g. output buffer) can be created in a
-        # similar way, if/when needed
+        # NOTE more buffer types can be created in a similar way, if/when
+        # needed
+        # NOTE in case of FIRST_TOUCH placement, the pages are touched first
+        # by the consumers i.e. the transformers
         self._databuffer_input = self._get_mpi_shared_memory_buffer(
-            self._buffer_size, self._intra_comm, DATA_BUFFER_TYPES.INPUT)
+            self._buffer_size, self._node_comm, DATA_BUFFER_TYPES.INPUT,
+            self._number_of_buffer_slots,
+            self._get_node_ranks(self._node_transformer_ranks))
+        #  3.2) create output buffer
+        # NOTE it is only needed in case of two-way communication, i.e. if
+        # there is a group of senders
+        if self._sender_group_ranks:
+            self._databuffer_output = self._get_mpi_shared_memory_buffer(
+                self._output_buffer_size, self._node_comm,
+                DATA_BUFFER_TYPES.OUTPUT, self._number_of_buffer_slots,
+                self._get_node_ranks(self._sender_group_ranks))
+        # NOTE the INDEX buffer is only needed if the receivers group the
+        # spike events by neuron for the transformers
+        if self._direction == DATA_EXCHANGE_DIRECTION.NEST_TO_TVB and \
+                getattr(self._sci_params, 'receiver_spike_index', False):
+            # number of neurons, offsets of the neurons and the spike times
+            self._get_mpi_shared_memory_buffer(
+                self._sci_params.nb_neurons + 2 + self._buffer_size,
+                self._node_comm, DATA_BUFFER_TYPES.INDEX,
+                self._number_of_buffer_slots,
+                self._get_node_ranks(self._node_transformer_ranks))
+        #  3.3) create progress counters of the transformers
+        # NOTE a slot of the INPUT buffer can be refilled as soon as all
+        # transformers (of the node) are done with it, without a global
+        # synchronization
+        self._data_buffer_manager.create_mpi_shared_memory_consumer_progress(
+            len(self._node_transformer_ranks), self._node_comm,
+            DATA_BUFFER_TYPES.INPUT)
+        #  3.4) create fill counters and overflow regions of the INPUT buffer
+        # NOTE the receivers reserve disjoint ranges of a slot of the INPUT
+        # buffer, and the last receiver done with the slot publishes it
+        self._data_buffer_manager.create_mpi_shared_memory_fill_counters(
+            self._node_comm, DATA_BUFFER_TYPES.INPUT)
+        # NOTE the data of a bursty step which does not fit into a slot of
+        # the INPUT buffer is kept in the overflow regions of the receivers
+        self._data_buffer_manager.create_mpi_overflow_regions(
+            len(self._receiver_group_ranks), self._node_comm,
+            DATA_BUFFER_TYPES.INPUT)
+        #  3.5) create progress counters of the senders and fill counters of
+        # the OUTPUT buffer
+        # NOTE a slot of the OUTPUT buffer can be refilled as soon as all
+        # senders are done with it, and the transformers can write their
+        # parts of the translated data directly into the slot
+        if self._sender_group_ranks:
+            self._data_buffer_manager.create_mpi_shared_memory_consumer_progress(
+                len(self._sender_group_ranks), self._node_comm,
+                DATA_BUFFER_TYPES.OUTPUT)
+            self._data_buffer_manager.create_mpi_shared_memory_fill_counters(
+                self._node_comm, DATA_BUFFER_TYPES.OUTPUT)
+            # NOTE the translated data of a step which does not fit into a
+            # slot of the OUTPUT buffer is kept in the overflow regions of
+            # the transformers
+            self._data_buffer_manager.create_mpi_overflow_regions(
+                len(self._transformer_group_ranks), self._node_comm,
+                DATA_BUFFER_TYPES.OUTPUT)
+        #  3.6) create the control block
+        # NOTE the simulation status is signalled to the transformers through
+        # shared memory
+        self._data_buffer_manager.create_mpi_shared_memory_control_block(
+            self._node_comm)
         
         # STEP 4) initialize buffers state
         info_log_message(self._my_rank,
@@ -125,7 +219,13 @@ class BaseManager(ABC):
         if self._receiver_intra_comm and self._intra_comm.Get_rank() == self._receiver_group_ranks[0]:
             self._set_buffer_state(state=DATA_BUFFER_STATES.READY_TO_RECEIVE,
                                    buffer_type=DATA_BUFFER_TYPES.INPUT)
-        # sync up point so that initial state of the INPUT buffer could be set
+        # 4.2) initialize the output buffer state
+        # NOTE state is set to 'READY_TO_RECEIVE' to wait until some data is
+        # translated by transformers
+        if self._sender_intra_comm and self._intra_comm.Get_rank() == self._sender_group_ranks[0]:
+            self._set_buffer_state(state=DATA_BUFFER_STATES.READY_TO_RECEIVE,
+                                   buffer_type=DATA_BUFFER_TYPES.OUTPUT)
+        # sync up point so that initial state of the buffers could be set
         debug_log_message(self._root,
                           self._logger,
                           "wait until the initial state is set")
@@ -136,32 +236,119 @@ class BaseManager(ABC):
                          self._logger,
                          "STEP 5: setting up data channels...")
         self._data_channel_setup()
+
+        # STEP 6) create the completion markers of the NEST ranks
+        # NOTE they are only needed if the transformers translate the
+        # package of each NEST rank as soon as it is received
+        if self._direction == DATA_EXCHANGE_DIRECTION.NEST_TO_TVB and \
+                getattr(self._sci_params, 'streaming_transformation', False):
+            info_log_message(self._my_rank,
+                             self._logger,
+                             "STEP 6: creating completion markers of the NEST ranks...")
+            self._create_source_markers()
         
         debug_log_message(self._root, self._logger, "initialized")
 
     def _set_buffer_state(self, state, buffer_type):
-        """helper function to set the buffer state for the given buffer_type"""
-        self._data_buffer_manager.set_ready_state_at(index=-1,
-                                                     state=state,
-                                                     buffer_type=buffer_type)
+        """
+        helper function to set the buffer state of all slots for the given
+        buffer_type, and to mark that the slots contain no data yet
+        """
+        for slot in range(self._data_buffer_manager.get_number_of_slots(buffer_type)):
+            self._data_buffer_manager.set_state(state=state,
+                                                buffer_type=buffer_type,
+                                                slot=slot)
+            self._data_buffer_manager.set_sequence_number(sequence_number=-1,
+                                                          buffer_type=buffer_type,
+                                                          slot=slot)
 
     def _setup_mpi_groups_and_comms(self):
         """
             helper function to group mpi processes based on their functionality
         """
         # Case a, rank belongs to receivers group
-        if self._intra_comm.Get_rank() == self._receiver_group_ranks[0]:  
+        if self._intra_comm.Get_rank() in self._receiver_group_ranks:
             self._receiver_intra_comm = self._setup_mpi_groups_including_ranks(self._receiver_group_ranks)
 
         # Case b, two way communication and rank belongs to senders group
-        elif self._sender_group_ranks and self._intra_comm.Get_rank() == self._sender_group_ranks[0]:
+        elif self._intra_comm.Get_rank() in self._sender_group_ranks:
             self._sender_intra_comm = self._setup_mpi_groups_including_ranks(self._sender_group_ranks)
 
         # Case c, rank belongs to transformers group
         elif self._intra_comm.Get_rank() in self._transformer_group_ranks:
             self._transformer_intra_comm = self._setup_mpi_groups_including_ranks(self._transformer_group_ranks)
 
-    def _get_mpi_shared_memory_buffer(self, buffer_size, comm, buffer_type):
+    def _setup_node_comms(self):
+        """
+            helper function to group mpi processes by the node (i.e. the
+            shared memory domain) they run on
+
+            NOTE every node has its own buffers. The Receivers and Senders
+            groups and the root transformer must run on the node of rank 0.
+            The data of a step is relayed from there to the first rank of
+            each other node, via the relay communicator, so that the
+            transformers read it from the shared memory of their own node.
+        """
+        self._node_comm = self._intra_comm.Split_type(MPI.COMM_TYPE_SHARED,
+                                                      key=self._my_rank)
+        self._node_ranks = self._node_comm.allgather(self._my_rank)
+        self._node_transformer_ranks = [rank for rank in self._node_ranks
+                                        if rank in self._transformer_group_ranks]
+        main_node_ranks = self._intra_comm.bcast(self._node_ranks, root=0)
+        # Case a, all ranks run on a single node
+        if len(main_node_ranks) == self._intra_comm.Get_size():
+            return
+
+        # Case b, the ranks run on several nodes
+        ranks_on_main_node = (self._receiver_group_ranks +
+                              self._sender_group_ranks +
+                              self._transformer_group_ranks[:1])
+        if not set(ranks_on_main_node).issubset(main_node_ranks):
+            self._logger.critical(f"ranks: {ranks_on_main_node} must run on "
+                                  f"the node of rank 0, ranks on the node: "
+                                  f"{main_node_ranks}")
+            raise RuntimeError
+        # the first rank of each node, the root transformer relays for the
+        # node of rank 0
+        is_first_on_node = self._node_comm.Get_rank() == 0
+        first_ranks = [rank for rank in self._intra_comm.allgather(
+                           self._my_rank if is_first_on_node else None)
+                       if rank is not None and rank not in main_node_ranks]
+        relay_ranks = self._transformer_group_ranks[:1] + first_ranks
+        info_log_message(self._my_rank,
+                         self._logger,
+                         f"running on {len(first_ranks) + 1} nodes, relay "
+                         f"ranks: {relay_ranks}")
+        if self._my_rank in relay_ranks:
+            self._relay_comm = self._setup_mpi_groups_including_ranks(relay_ranks)
+
+    def _create_source_markers(self):
+        """
+        helper function to create the completion markers of the sources
+        (i.e. NEST ranks) of the INPUT buffer
+
+        NOTE each receiver is connected to its own NEST ranks, their number
+        is known only once the receivers are connected, so it is gathered
+        from all receivers
+        """
+        number_of_nest_ranks = 0
+        if self._my_rank in self._receiver_group_ranks:
+            number_of_nest_ranks = self._receiver_inter_comm.Get_remote_size()
+        gathered_numbers = self._intra_comm.allgather(number_of_nest_ranks)
+        nest_ranks_per_receiver = [gathered_numbers[rank] for rank in self._receiver_group_ranks]
+        self._data_buffer_manager.create_mpi_shared_memory_source_markers(
+            nest_ranks_per_receiver, self._node_comm, DATA_BUFFER_TYPES.INPUT)
+
+    def _get_node_ranks(self, ranks):
+        """
+        helper function to translate the given ranks to their ranks in the
+        node communicator, the ranks on the other nodes are left out
+        """
+        return [self._node_ranks.index(rank) for rank in ranks
+                if rank in self._node_ranks]
+
+    def _get_mpi_shared_memory_buffer(self, buffer_size, comm, buffer_type,
+                                      number_of_slots=1, first_touch_ranks=None):
         """
         Creates shared memory buffer for MPI One-sided-Communication.
         This is wrapper to buffer manager function which creates the mpi
@@ -172,7 +359,9 @@ class BaseManager(ABC):
             self._data_buffer_manager.create_mpi_shared_memory_buffer(
                 buffer_size,
                 comm,
-                buffer_type)
+                buffer_type,
+                number_of_slots,
+                first_touch_ranks)
         return self._interscalehub_buffer
 
     def _data_channel_setup(self):
@@ -263,6 +452,11 @@ class BaseManager(ABC):
         """
         raise NotImplementedError
         
+    def _log_buffer_statistics(self):
+        """logs the statistics of the data buffers e.g. waiting times"""
+        self._data_buffer_manager.log_wait_latencies()
+        self._data_buffer_manager.log_buffer_usage()
+
     def _close_data_channels(self):
         info_log_message(self._my_rank,
                          self._logger,
@@ -67,7 +67,10 @@ class NestToLFPyManager(BaseManager):
         # NOTE Refactoring of communication protocols and data management is
         # needed when more than one ranks are used for
         # intercommunication (sending, receiving) with simulators
-        receiver_group_ranks = [0]  # NOTE hardcoded rank-0
+        # NOTE the first ranks receive from NEST, each from a subset of NEST
+        # ranks
+        number_of_receivers = getattr(self.__sci_params, 'number_of_nest_receivers', 1)
+        receiver_group_ranks = list(range(number_of_receivers))
         sender_group_ranks = []  # NOTE One way commuinication for this use-case
         
         # NOTE TRANSLATION_FUNCTION_ID.USER_LAND indicates that the
@@ -155,7 +158,10 @@ class NestToLFPyManager(BaseManager):
             self._sender_group_ranks,
             self._receiver_group_ranks,
             root_transformer_rank,  # root transformer rank
-            spike_detector_ids
+            spike_detector_ids,
+            concurrent_receive=getattr(self.__sci_params, 'concurrent_nest_receive', True),
+            batched_status_check=getattr(self.__sci_params, 'batched_nest_status_check', True),
+            receiver_intra_comm=self._receiver_intra_comm
             )
 
         self.__transformer_communicator = TransformerCommunicator(
@@ -170,7 +176,9 @@ class NestToLFPyManager(BaseManager):
             self.__parameters,
             self.__sci_params,
             self.__translation_function_id,
-            self.__translation_function
+            self.__translation_function,
+            node_transformer_ranks=self._node_transformer_ranks,
+            relay_comm=self._relay_comm
         )
 
         my_rank = self._intra_comm.Get_rank()
@@ -201,5 +209,6 @@ class NestToLFPyManager(BaseManager):
         if self._my_rank == self._transformer_group_ranks[0]:
             self.__lfpy_pd_kernels.save_final_results()
             self.__lfpy_pd_kernels.plot_final_results()
+        self._log_buffer_statistics()
         self._close_data_channels()
         return Response.OK
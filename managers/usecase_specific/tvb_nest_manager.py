@@ -15,6 +15,7 @@ from EBRAINS_InterscaleHUB.communicators.nest.nest_communicator import NestCommu
 from EBRAINS_InterscaleHUB.communicators.tvb.tvb_communicator import TVBCommunicator
 from EBRAINS_InterscaleHUB.communicators.transformer.transformer_communicator import TransformerCommunicator
 from EBRAINS_InterscaleHUB.common.interscalehub_enums import DATA_EXCHANGE_DIRECTION, TRANSLATION_FUNCTION_ID
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import SPIKE_EVENT_ENCODINGS
 from EBRAINS_InterscaleHUB.common.interscalehub_utils import info_log_message, debug_log_message
 
 from EBRAINS_RichEndpoint.application_companion.common_enums import Response
@@ -56,6 +57,7 @@ class TvbNestManager(BaseManager):
         self.__sci_params = Xml2ClassParser(sci_params_xml_path_filename, self.__logger)
         self.__direction = direction
         buffer_size = None
+        output_buffer_size = None
         self.__translation_function = None
 
         # TODO get these settings via XML configurations file
@@ -63,14 +65,25 @@ class TvbNestManager(BaseManager):
         # needed when more than one ranks are used for
         # intercommunication (sending, receiving) with simulators
         if self.__direction == DATA_EXCHANGE_DIRECTION.TVB_TO_NEST:
-            receiver_group_ranks = [1]  # NOTE hardcoded rank-1
-            sender_group_ranks = [0]  # NOTE hardcoded rank-0
+            # NOTE the first ranks send to NEST, each to a subset of NEST
+            # ranks
+            number_of_senders = getattr(self.__sci_params, 'number_of_nest_senders', 1)
+            sender_group_ranks = list(range(number_of_senders))
+            receiver_group_ranks = [number_of_senders]  # NOTE the next rank receives from TVB
             self.__translation_function_id = TRANSLATION_FUNCTION_ID.RATE_TO_SPIKES
             # set buffer size
             buffer_size = self.__sci_params.max_events + self.__sci_params.tvb_buffer_size_factor
+            # NOTE the OUTPUT buffer holds the number of spike trains, their
+            # starts and ends and the spike times, the spike times of a step
+            # with more than max_events spikes go into the overflow regions
+            # of the transformers
+            output_buffer_size = 2 * self.__sci_params.nb_neurons + 1 + self.__sci_params.max_events
         elif self.__direction == DATA_EXCHANGE_DIRECTION.NEST_TO_TVB:
-            receiver_group_ranks = [0]  # NOTE hardcoded rank-0
-            sender_group_ranks = [1]  # NOTE hardcoded rank-1
+            # NOTE the first ranks receive from NEST, each from a subset of
+            # NEST ranks
+            number_of_receivers = getattr(self.__sci_params, 'number_of_nest_receivers', 1)
+            receiver_group_ranks = list(range(number_of_receivers))
+            sender_group_ranks = [number_of_receivers]  # NOTE the next rank sends to TVB
             self.__translation_function_id = TRANSLATION_FUNCTION_ID.SPIKE_TO_RATES
             # set buffer size
             buffer_size = self.__sci_params.max_events * self.__sci_params.nest_buffer_size_factor
@@ -83,7 +96,8 @@ class TvbNestManager(BaseManager):
                          buffer_size,
                          self.__parameters,
                          self.__sci_params,
-                         self.__direction
+                         self.__direction,
+                         output_buffer_size=output_buffer_size
                          )
         
         info_log_message(self._my_rank,
@@ -117,7 +131,12 @@ class TvbNestManager(BaseManager):
                 self._sender_group_ranks,
                 self._receiver_group_ranks,
                 root_transformer_rank,  # root transformer rank
-                spike_detector_ids
+                spike_detector_ids,
+                concurrent_receive=getattr(self.__sci_params, 'concurrent_nest_receive', True),
+                batched_status_check=getattr(self.__sci_params, 'batched_nest_status_check', True),
+                receiver_intra_comm=self._receiver_intra_comm,
+                sender_intra_comm=self._sender_intra_comm,
+                **self.__get_spike_event_encoding()
                 )
             
             self.__tvb_communicator = TVBCommunicator(
@@ -129,7 +148,8 @@ class TvbNestManager(BaseManager):
                self._sender_inter_comm,
                self._sender_group_ranks,
                self._receiver_group_ranks,
-               root_transformer_rank  # root transformer rank
+               root_transformer_rank,  # root transformer rank
+               persistent_requests=getattr(self.__sci_params, 'tvb_persistent_requests', False)
                )
 
             self.__transformer_communicator = TransformerCommunicator(
@@ -144,7 +164,9 @@ class TvbNestManager(BaseManager):
                 self.__parameters,
                 self.__sci_params,
                 self.__translation_function_id,
-                self.__translation_function
+                self.__translation_function,
+                node_transformer_ranks=self._node_transformer_ranks,
+                relay_comm=self._relay_comm
             )
             
             my_rank = self._intra_comm.Get_rank()
@@ -196,8 +218,23 @@ class TvbNestManager(BaseManager):
             # operation
             return response
 
+    def __get_spike_event_encoding(self):
+        """
+        returns the settings to encode (and group by neuron) the spike events
+        received from NEST
+
+        NOTE the spike events are only received in case of NEST to TVB
+        """
+        if self.__direction != DATA_EXCHANGE_DIRECTION.NEST_TO_TVB:
+            return {}
+        return {'spike_event_encoding': getattr(self.__sci_params, 'spike_event_encoding',
+                                                SPIKE_EVENT_ENCODINGS.RAW),
+                'first_neuron_id': self.__parameters['id_first_neurons'][0],
+                'dt': self.__sci_params.dt,
+                'nb_neurons': self.__sci_params.nb_neurons}
                 
     def stop(self):
         """Closes the data channels"""
+        self._log_buffer_statistics()
         self._close_data_channels()
         return Response.OK
@@ -0,0 +1,89 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+"""
+Compares the native rate engine (SpikeRateConvertor.spike_times_to_rate) with
+the reference i.e. elephant.statistics.instantaneous_rate
+
+NOTE the tests are skipped if elephant (or the other dependencies of the
+InterscaleHub) is not installed
+"""
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("elephant")
+pytest.importorskip("mpi4py")
+pytest.importorskip("EBRAINS_ConfigManager")
+
+from quantities import ms
+from neo.core import SpikeTrain
+
+from EBRAINS_InterscaleHUB.translator.delegation.spike_rate_inter_conversion import SpikeRateConvertor
+
+
+class _ConfigurationsManager:
+    """provides the logger, as the configurations manager does"""
+    def load_log_configurations(self, name, log_configurations, target_directory):
+        return logging.getLogger(name)
+
+
+def _get_spike_rate_convertor(dt, time_synch, nb_neurons):
+    sci_params = SimpleNamespace(time_syncronization=time_synch,
+                                 dt=dt,
+                                 nb_neurons=nb_neurons,
+                                 nb_brain_synapses=1)
+    return SpikeRateConvertor(_ConfigurationsManager(), None, sci_params=sci_params)
+
+
+def _get_spike_times(count, dt, time_synch, nb_neurons, rng):
+    """returns random spike times of the step on the grid of dt, per neuron"""
+    t_start = np.around(count * time_synch, decimals=2)
+    t_stop = np.around((count + 1) * time_synch, decimals=2)
+    grid = np.around(np.arange(t_start, t_stop + dt / 2, dt), decimals=4)
+    return [np.sort(rng.choice(grid, size=rng.integers(0, 20)))
+            for _ in range(nb_neurons)]
+
+
+@pytest.mark.parametrize("dt", [0.1, 0.05, 0.025])
+@pytest.mark.parametrize("count", [0, 1, 7])
+def test_native_rate_matches_elephant(dt, count):
+    time_synch = 2.0
+    nb_neurons = 50
+    spike_rate_convertor = _get_spike_rate_convertor(dt, time_synch, nb_neurons)
+    spike_times = _get_spike_times(count, dt, time_synch, nb_neurons,
+                                   np.random.default_rng(count))
+
+    # reference, same spike trains as spike_events_to_spiketrains creates
+    t_start = np.around(count * time_synch, decimals=2)
+    t_stop = np.around((count + 1) * time_synch, decimals=2) + 0.0001
+    spike_trains = [SpikeTrain(times * ms, t_start=t_start, t_stop=t_stop)
+                    for times in spike_times]
+    reference_times, reference_rate = spike_rate_convertor.spiketrains_to_rate(
+        count, spike_trains)
+    reference_rate = np.asarray(reference_rate).ravel()
+
+    native_times, native_rate = spike_rate_convertor.spike_times_to_rate(
+        count, np.concatenate(spike_times), nb_neurons)
+
+    np.testing.assert_array_equal(native_times, reference_times)
+    assert native_rate.shape == reference_rate.shape
+    np.testing.assert_allclose(native_rate, reference_rate, rtol=1e-9, atol=1e-9)
+
+
+def test_native_rate_of_no_spikes_is_zero():
+    spike_rate_convertor = _get_spike_rate_convertor(0.1, 2.0, 10)
+    _, native_rate = spike_rate_convertor.spike_times_to_rate(3, np.empty(0), 10)
+    assert not native_rate.any()
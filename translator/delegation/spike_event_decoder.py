@@ -0,0 +1,131 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import numpy as np
+
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import SPIKE_EVENT_ENCODINGS
+
+
+# NOTE a compact spike event takes as much space as a single double, i.e.
+# a third of a raw spike event
+COMPACT_SPIKE_EVENT_DTYPES = {
+    SPIKE_EVENT_ENCODINGS.COMPACT_TICKS: np.dtype([('neuron', np.int32), ('time', np.int32)]),
+    SPIKE_EVENT_ENCODINGS.COMPACT_FLOAT32: np.dtype([('neuron', np.int32), ('time', np.float32)]),
+}
+
+
+def decode_spike_events(raw_data, first_neuron_id, nb_neurons):
+    """
+    Groups the spike events received from NEST by neuron into a CSR
+    (compressed sparse row) layout.
+
+    NOTE NEST sends 3 values for each spike event i.e.
+    (spike detector id, neuron id, spike time)
+    --> Assumption: len(raw_data) is always a multiple of 3
+
+    Parameters
+    ----------
+    raw_data: numpy array
+        flat array of spike events
+
+    first_neuron_id: int
+        id of the first neuron
+
+    nb_neurons: int
+        number of neurons
+
+    Returns
+    ------
+        spike_event_offsets, spike_times: numpy array, numpy array
+            the spike times of the neuron i are
+            spike_times[spike_event_offsets[i]:spike_event_offsets[i+1]], in
+            the order they are received
+    """
+    spike_events = raw_data[:(raw_data.shape[0] // 3) * 3].reshape(-1, 3)
+    neuron_indices = spike_events[:, 1].astype(np.int64) - first_neuron_id
+    if neuron_indices.shape[0] and (neuron_indices.min() < 0 or
+                                    neuron_indices.max() >= nb_neurons):
+        raise ValueError(f"neuron ids are out of range: [{first_neuron_id}, "
+                         f"{first_neuron_id + nb_neurons})")
+
+    # counting sort: number of spikes per neuron gives the offsets, and the
+    # stable sort keeps the received order of the spikes of a neuron
+    spike_event_offsets = np.zeros(nb_neurons + 1, dtype=np.int64)
+    np.cumsum(np.bincount(neuron_indices, minlength=nb_neurons),
+              out=spike_event_offsets[1:])
+    spike_times = spike_events[:, 2][np.argsort(neuron_indices, kind='stable')]
+    return spike_event_offsets, spike_times
+
+
+def encode_spike_events(raw_data, compact_events, first_neuron_id, dt=None):
+    """
+    Encodes the spike events received from NEST into the compact format i.e.
+    (neuron index relative to the first neuron, spike time).
+
+    Parameters
+    ----------
+    raw_data: numpy array
+        flat array of spike events, see decode_spike_events
+
+    compact_events: numpy structured array
+        array (e.g. a view of the buffer) of len(raw_data) // 3 compact
+        spike events, see COMPACT_SPIKE_EVENT_DTYPES
+
+    first_neuron_id: int
+        id of the first neuron
+
+    dt: float
+        resolution of the simulation, if given the spike times are stored
+        in ticks of it
+    """
+    spike_events = raw_data[:(raw_data.shape[0] // 3) * 3].reshape(-1, 3)
+    compact_events['neuron'] = spike_events[:, 1] - first_neuron_id
+    if dt is None:
+        compact_events['time'] = spike_events[:, 2]
+    else:
+        compact_events['time'] = np.rint(spike_events[:, 2] / dt)
+
+
+def decode_compact_spike_events(compact_events, nb_neurons, dt=None):
+    """
+    Groups the compact spike events (see encode_spike_events) by neuron into
+    a CSR layout, same as decode_spike_events.
+
+    Parameters
+    ----------
+    compact_events: numpy structured array
+        compact spike events, see COMPACT_SPIKE_EVENT_DTYPES
+
+    nb_neurons: int
+        number of neurons
+
+    dt: float
+        resolution of the simulation, if given the spike times are in ticks
+        of it
+
+    Returns
+    ------
+        spike_event_offsets, spike_times: numpy array, numpy array
+    """
+    neuron_indices = compact_events['neuron']
+    if neuron_indices.shape[0] and (neuron_indices.min() < 0 or
+                                    neuron_indices.max() >= nb_neurons):
+        raise ValueError(f"neuron indices are out of range: [0, {nb_neurons})")
+
+    spike_event_offsets = np.zeros(nb_neurons + 1, dtype=np.int64)
+    np.cumsum(np.bincount(neuron_indices, minlength=nb_neurons),
+              out=spike_event_offsets[1:])
+    spike_times = compact_events['time'][np.argsort(neuron_indices, kind='stable')].astype('d')
+    if dt is not None:
+        spike_times *= dt
+    return spike_event_offsets, spike_times
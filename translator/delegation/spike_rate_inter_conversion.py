@@ -11,20 +11,20 @@
 # Laboratory: Simulation Laboratory Neuroscience
 # Team: Multi-scale Simulation and Design
 # ------------------------------------------------------------------------------
+import math
+
+from mpi4py import MPI
 import numpy as np
 
-from quantities import ms, Hz
-from neo.core import AnalogSignal, SpikeTrain
+from quantities import ms
+from neo.core import SpikeTrain
 
+import elephant
 from elephant.statistics import instantaneous_rate  # , mean_firing_rate
 from elephant.kernels import RectangularKernel
 
-# TODO:
-# 'inhomogeneous_poisson_process' is deprecated; use 'NonStationaryPoissonProcess'.
-# 'homogeneous_poisson_process' is deprecated; use 'StationaryPoissonProcess'.
-from elephant.spike_train_generation import inhomogeneous_poisson_process  # , homogeneous_poisson_process
-
-from EBRAINS_InterscaleHUB.common.interscalehub_utils import debug_log_message
+from EBRAINS_InterscaleHUB.common.interscalehub_utils import debug_log_message, info_log_message
+from EBRAINS_InterscaleHUB.translator.delegation.workload_partitioner import WorkloadPartitioner
 
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
 
@@ -43,47 +43,73 @@ class SpikeRateConvertor:
         self.__dt = sci_params.dt
         self.__nb_neurons = sci_params.nb_neurons
         self.__nb_synapse = sci_params.nb_brain_synapses
+        # width (sigma) of the rectangular kernel to compute the rates, in ms
+        self.__kernel_sigma = 1.0
+        # cutoff of the kernel, in units of sigma (same as the default of
+        # elephant.statistics.instantaneous_rate)
+        self.__kernel_cutoff = 5.0
+        # NOTE elephant < 0.11 counts the spikes on one more bin, up to the
+        # end of the step plus the sampling period, and leaves out the rate
+        # of the last bin
+        self.__has_extra_bin = tuple(
+            int(number) for number in elephant.__version__.split('.')[:2]) < (0, 11)
+        # NOTE the sampling period is slightly smaller than the resolution to
+        # have as many samples as integration steps in a synchronization step
+        self.__sampling_period = self.__dt - 0.000001
+        # random generator for the Poisson processes
+        self.__rng = np.random.default_rng()
+        # splits the neurons among the transformers, as per workload
+        self.__partitioners = {}
+        self.__imbalance_threshold = getattr(sci_params, 'imbalance_threshold', 0.1)
 
         debug_log_message(rank=0,
                           logger=self.__logger,
                           msg="Initialised")
 
-    def spike_events_to_spiketrains(self, count, spike_events, comm, transformers_root_rank):
+    def spike_events_to_spiketrains(self, count, spike_event_offsets, spike_times,
+                                    comm, transformers_root_rank):
         """
-        get the spike time from the buffer and order them by neurons
+        get the spike times grouped by neurons (CSR layout, see
+        decode_spike_events) and create the spike trains
+
+        NOTE each transformer slices the spike trains of its chunk of neurons
+        in parallel, the chunks are gathered on root as flat arrays (i.e. no
+        pickling) and root only wraps them into SpikeTrains.
         """
-        number_transformers = comm.Get_size()
+        # split the neurons as per number of transformers
+        # NOTE the chunks are the same as of numpy.array_split
+        number_of_neurons = spike_event_offsets.shape[0] - 1
+        neurons_per_transformer, remainder = divmod(number_of_neurons, comm.Get_size())
         transformer_rank = comm.Get_rank()  # NOTE this is the group rank
-        # split the spike_events as per number of transformers
-        spike_events_per_transformer = np.array_split(range(len(spike_events)),
-                                                      number_transformers)
-        partial_spike_trains = []
+        first_neuron = transformer_rank * neurons_per_transformer + min(transformer_rank, remainder)
+        last_neuron = first_neuron + neurons_per_transformer + (transformer_rank < remainder)
+        partial_spike_event_offsets = spike_event_offsets[first_neuron:last_neuron + 1]
+        partial_spike_times = spike_times[partial_spike_event_offsets[0]:
+                                          partial_spike_event_offsets[-1]]
 
-        # compute SpikeTrains in parallel on all Transformers
-        for i in spike_events_per_transformer[transformer_rank]:
+        # gather the results on root
+        gathered_spike_trains = self.__gather_spike_trains(partial_spike_event_offsets,
+                                                           partial_spike_times,
+                                                           comm,
+                                                           transformers_root_rank)
+        if gathered_spike_trains is None:
+            return None
+
+        gathered_spike_event_offsets, gathered_spike_times = gathered_spike_trains
+        t_start = np.around(count * self.__time_synch, decimals=2)
+        t_stop = np.around((count + 1) * self.__time_synch, decimals=2) + 0.0001
+        spike_trains = []
+        for i in range(number_of_neurons):
             try:
-                if len(spike_events[i]) > 1:
-                    partial_spike_trains.append(SpikeTrain(np.concatenate(spike_events[i]) * ms,
-                                                t_start=np.around(count * self.__time_synch, decimals=2),
-                                                t_stop=np.around((count + 1) * self.__time_synch, decimals=2) + 0.0001))
-                else:
-                    partial_spike_trains.append(SpikeTrain(spike_events[i] * ms,
-                                                t_start=np.around(count * self.__time_synch, decimals=2),
-                                                t_stop=np.around((count + 1) * self.__time_synch, decimals=2) + 0.0001))
+                spike_trains.append(SpikeTrain(
+                    gathered_spike_times[gathered_spike_event_offsets[i]:gathered_spike_event_offsets[i+1]],
+                    units=ms,
+                    t_start=t_start,
+                    t_stop=t_stop))
             except Exception as e:
                 self.__logger.exception(e)
                 raise
-        
-        # gather the results on root
-        gathered_spike_trains = comm.gather(partial_spike_trains, root=transformers_root_rank)
-        # flatten the nested lists on root
-        if transformer_rank == transformers_root_rank:
-            spike_trains = gathered_spike_trains[0]
-            for rank in range(1, comm.Get_size()):
-                spike_trains += gathered_spike_trains[rank]
-            return spike_trains
-        else:
-            return None
+        return spike_trains
 
     def spiketrains_to_rate(self, count, spiketrains):
         """
@@ -93,39 +119,333 @@ class SpikeRateConvertor:
         rates = instantaneous_rate(spiketrains,
                                    t_start=np.around(count * self.__time_synch, decimals=2) * ms,
                                    t_stop=np.around((count + 1) * self.__time_synch, decimals=2) * ms,
-                                   sampling_period=(self.__dt - 0.000001) * ms, kernel=RectangularKernel(1.0 * ms))
+                                   sampling_period=self.__sampling_period * ms,
+                                   kernel=RectangularKernel(self.__kernel_sigma * ms))
         rate = np.mean(rates, axis=1) / 10  # the division by 10 ia an adaptation for the model of TVB
         times = np.array([count * self.__time_synch, (count + 1) * self.__time_synch], dtype='d')
         return times, rate
 
+    def spike_times_to_rate(self, count, spike_times, number_of_spike_trains):
+        """
+        Computes the same population rate as spiketrains_to_rate, but straight
+        from the spike times of all neurons i.e. without creating the spike
+        trains.
+
+        The spike times are histogrammed on the sampling grid and filtered with
+        the rectangular kernel as a moving sum (cumulative sum). As the
+        convolution is linear, the mean of the rates of the neurons is the
+        rate of the pooled spike times divided by the number of neurons.
+
+        Parameters
+        ----------
+        count: int
+            counter of the number of time of the transformation
+
+        spike_times: numpy array
+            spike times of all neurons (e.g. CSR spike times)
+
+        number_of_spike_trains: int
+            number of neurons
+
+        Returns
+        ------
+            times, rate: numpy array, numpy array
+        """
+        histogram = self.spike_times_to_histogram(count, spike_times)
+        rate = self.histogram_to_rate(histogram, number_of_spike_trains)
+        times = np.array([count * self.__time_synch, (count + 1) * self.__time_synch], dtype='d')
+        return times, rate
+
+    def spike_events_to_rate(self, count, spike_event_offsets, spike_times,
+                             comm, transformers_root_rank):
+        """
+        Computes the same population rate as spike_times_to_rate, in parallel
+        on all transformers.
+
+        Each transformer histograms the spike times of its chunk of neurons,
+        the partial histograms are summed on root (Reduce) which then applies
+        the kernel.
+
+        Returns
+        ------
+            times, rate: numpy array, numpy array
+                on root, None otherwise
+        """
+        number_of_spike_trains = spike_event_offsets.shape[0] - 1
+        # NOTE the neurons are split as per the number of spikes per neuron
+        # of the previous steps
+        partitioner = self.__get_partitioner("spike_events_to_rate",
+                                             number_of_spike_trains,
+                                             comm.Get_size())
+        first_neuron, last_neuron = partitioner.get_range(comm.Get_rank())
+        # spike times of the chunk of neurons (view, no copy)
+        chunk_spike_times = spike_times[spike_event_offsets[first_neuron]:
+                                        spike_event_offsets[last_neuron]]
+        partial_histogram = np.ascontiguousarray(
+            self.spike_times_to_histogram(count, chunk_spike_times),
+            dtype=np.int64)
+
+        # balance the next steps with the number of spikes per neuron
+        self.__update_partitioner(partitioner, np.diff(spike_event_offsets), comm)
+
+        return self.partial_histograms_to_rate(count,
+                                               partial_histogram,
+                                               number_of_spike_trains,
+                                               comm,
+                                               transformers_root_rank)
+
+    def partial_histograms_to_rate(self, count, partial_histogram,
+                                   number_of_spike_trains, comm,
+                                   transformers_root_rank):
+        """
+        sums up the partial histograms (int64) of all transformers on root
+        (Reduce) which then applies the kernel
+
+        Returns
+        ------
+            times, rate: numpy array, numpy array
+                on root, None otherwise
+        """
+        is_root = comm.Get_rank() == transformers_root_rank
+        histogram = np.empty_like(partial_histogram) if is_root else None
+        comm.Reduce([partial_histogram, MPI.INT64_T],
+                    [histogram, MPI.INT64_T] if is_root else None,
+                    op=MPI.SUM,
+                    root=transformers_root_rank)
+        if not is_root:
+            return None, None
+
+        rate = self.histogram_to_rate(histogram, number_of_spike_trains)
+        times = np.array([count * self.__time_synch, (count + 1) * self.__time_synch], dtype='d')
+        return times, rate
+
+    def spike_times_to_histogram(self, count, spike_times):
+        """
+        counts the spike times on the sampling grid of the given step (same
+        bins as elephant.statistics.instantaneous_rate)
+        """
+        t_start = np.around(count * self.__time_synch, decimals=2)
+        t_stop = np.around((count + 1) * self.__time_synch, decimals=2)
+        number_of_bins = int((t_stop - t_start) / self.__sampling_period)
+        if self.__has_extra_bin:
+            number_of_bins += 1
+            t_end = t_stop + self.__sampling_period
+        else:
+            t_end = t_start + number_of_bins * self.__sampling_period
+        histogram, _ = np.histogram(spike_times,
+                                    bins=number_of_bins,
+                                    range=(t_start, t_end))
+        return histogram
+
+    def histogram_to_rate(self, histogram, number_of_spike_trains):
+        """
+        filters the (pooled) spike counts with the rectangular kernel and
+        returns the mean rate per neuron
+        """
+        # the kernel is evaluated on the same grid as elephant does i.e.
+        # 2 * n + 1 points spread evenly over +/- cutoff * sigma, in units of
+        # the sampling period, and centered at the median of the kernel
+        half_width = np.sqrt(3.0) * self.__kernel_sigma  # in ms
+        number_of_half_points = math.ceil(self.__kernel_cutoff * self.__kernel_sigma /
+                                          self.__sampling_period)
+        cutoff_sigma = self.__kernel_cutoff * self.__kernel_sigma / self.__sampling_period
+        kernel_grid = np.linspace(-cutoff_sigma, cutoff_sigma,
+                                  num=2 * number_of_half_points + 1)
+        # NOTE the kernel is flat and its support is symmetric around the
+        # median i.e. the middle point of the grid
+        support = np.flatnonzero(np.abs(kernel_grid) < half_width / self.__sampling_period)
+        reach = number_of_half_points - support[0]
+        # rate[n] = sum of counts in [n - reach, n + reach] * kernel height
+        cumulative_counts = np.concatenate(([0], np.cumsum(histogram)))
+        bins = np.arange(histogram.shape[0])
+        moving_sum = (cumulative_counts[np.clip(bins + reach + 1, 0, histogram.shape[0])] -
+                      cumulative_counts[np.clip(bins - reach, 0, histogram.shape[0])])
+        if self.__has_extra_bin:
+            moving_sum = moving_sum[:-1]
+        # height of the kernel in Hz
+        kernel_height = 0.5 / half_width * 1000.0
+        # NOTE the division by 10 ia an adaptation for the model of TVB
+        return moving_sum * kernel_height / number_of_spike_trains / 10
+
     def rate_to_spikes(self, time_step, rates, comm, transformers_root_rank):
         """
         implements the abstract method for the transformation of the
         rate to spikes.
+
+        Returns
+        ------
+            spike_train_offsets, spike_times: numpy array, numpy array
+                on root, the spike times of the neuron i are
+                spike_times[spike_train_offsets[i]:spike_train_offsets[i+1]],
+                None otherwise
+        """
+        _, spike_train_offsets, spike_times = self.rate_to_partial_spikes(
+            time_step, rates, comm)
+        # gather the results at root_transformer_rank
+        return self.__gather_spike_trains(spike_train_offsets,
+                                          spike_times,
+                                          comm,
+                                          transformers_root_rank)
+
+    def rate_to_partial_spikes(self, time_step, rates, comm):
+        """
+        transforms the rate to the spike trains of the chunk of neurons of
+        the calling transformer, without gathering them
+
+        Returns
+        ------
+            first_neuron, spike_train_offsets, spike_times: int, numpy array, numpy array
+                the spike times of the neuron first_neuron+i are
+                spike_times[spike_train_offsets[i]:spike_train_offsets[i+1]]
         """
         # rate of poisson generator ( due property of poisson process)
         rate_of_poisson_generator = rates * self.__nb_synapse
         rate_of_poisson_generator += 1e-12
         rate_of_poisson_generator = np.abs(rate_of_poisson_generator)  # avoid rate equals to zeros
-        signal = AnalogSignal(rate_of_poisson_generator * Hz, t_start=(time_step[0] + 0.1) * ms,
-                              sampling_period=(time_step[1] - time_step[0]) / rate_of_poisson_generator.shape[-1] * ms)
-        partial_spike_trains = []
-        gathered_spike_trains = []
-        number_transformers = comm.Get_size()
-        transformer_rank = comm.Get_rank()  # NOTE this is the group rank
-        neuron_chunks_per_transformer = np.array_split(range(self.__nb_neurons), number_transformers)
+        t_start = time_step[0] + 0.1
+        sampling_period = (time_step[1] - time_step[0]) / rate_of_poisson_generator.shape[-1]
         # split the computation
-        for _ in range(len(neuron_chunks_per_transformer[transformer_rank])):
-            # TODO: 'inhomogeneous_poisson_process' is deprecated; use 'NonStationaryPoissonProcess'.
-            partial_spike_trains.append(np.around(np.sort(inhomogeneous_poisson_process(signal, as_array=True)), decimals=1))
+        # NOTE all neurons have the same rate, so the expected number of
+        # spikes is balanced by balancing the number of neurons
+        partitioner = self.__get_partitioner("rate_to_spikes",
+                                             self.__nb_neurons,
+                                             comm.Get_size())
+        first_neuron, last_neuron = partitioner.get_range(comm.Get_rank())
+        spike_train_offsets, spike_times = self.__generate_inhomogeneous_poisson_spike_trains(
+            last_neuron - first_neuron,
+            rate_of_poisson_generator,
+            t_start,
+            sampling_period)
+        return first_neuron, spike_train_offsets, spike_times
 
-        # gather the results at root_transformer_rank
-        gathered_spike_trains = comm.gather(partial_spike_trains, root=transformers_root_rank)
-        # flatten the nested lists on root
-        if transformer_rank == transformers_root_rank:
-            spike_trains = gathered_spike_trains[0]
-            for rank in range(1, comm.Get_size()):
-                spike_trains += gathered_spike_trains[rank]
-            return spike_trains
-        else:
+    def __get_partitioner(self, name, number_of_neurons, number_transformers):
+        """returns the partitioner with the given name, creates it if needed"""
+        if name not in self.__partitioners:
+            self.__partitioners[name] = WorkloadPartitioner(
+                number_of_neurons,
+                number_transformers,
+                imbalance_threshold=self.__imbalance_threshold)
+        return self.__partitioners[name]
+
+    def __update_partitioner(self, partitioner, workload, comm):
+        """
+        updates the partitioner with the measured workload per neuron and
+        reports the load per transformer
+        """
+        loads = partitioner.get_loads(workload)
+        debug_log_message(rank=comm.Get_rank(),
+                          logger=self.__logger,
+                          msg=f"load per transformer: {loads}, imbalance: "
+                          f"{partitioner.get_imbalance(workload):.2f}")
+        if partitioner.update(workload):
+            info_log_message(rank=comm.Get_rank(),
+                             logger=self.__logger,
+                             msg=f"rebalanced neurons (#{partitioner.number_of_rebalances}), "
+                             f"load per transformer before: {loads}, "
+                             f"after: {partitioner.get_loads(workload)}, "
+                             f"boundaries: {partitioner.boundaries}")
+
+    def __generate_inhomogeneous_poisson_spike_trains(self,
+                                                      number_of_spike_trains,
+                                                      rates,
+                                                      t_start,
+                                                      sampling_period):
+        """
+        Draws the spike trains of independent inhomogeneous Poisson processes
+        with the same piecewise constant rate for all neurons at once.
+
+        The number of spikes of a neuron in a sample is Poisson distributed
+        with mean rate * sampling_period, and the spikes are uniformly
+        distributed within the sample.
+
+        Parameters
+        ----------
+        number_of_spike_trains: int
+            number of neurons
+
+        rates: numpy array
+            rate of each sample in Hz
+
+        t_start: float
+            start time of the first sample in ms
+
+        sampling_period: float
+            duration of a sample in ms
+
+        Returns
+        ------
+            spike_train_offsets, spike_times: numpy array, numpy array
+                spike times (CSR layout) sorted per neuron and rounded to
+                0.1 ms
+        """
+        number_of_samples = rates.shape[0]
+        # NOTE the rates are in Hz and the sampling period is in ms
+        spike_counts = self.__rng.poisson(rates * sampling_period / 1000.0,
+                                          size=(number_of_spike_trains, number_of_samples))
+        spike_counts_per_neuron = spike_counts.sum(axis=1)
+        spike_train_offsets = np.zeros(number_of_spike_trains + 1, dtype=np.int64)
+        np.cumsum(spike_counts_per_neuron, out=spike_train_offsets[1:])
+        # sample index of each spike, ordered by neurons and then by samples
+        spike_samples = np.repeat(np.tile(np.arange(number_of_samples),
+                                          number_of_spike_trains),
+                                  spike_counts.ravel())
+        spike_times = t_start + (spike_samples + self.__rng.random(spike_samples.shape[0])) * sampling_period
+        # NOTE only spikes within the same sample are not yet in order
+        neuron_indices = np.repeat(np.arange(number_of_spike_trains), spike_counts_per_neuron)
+        spike_times = spike_times[np.lexsort((spike_times, neuron_indices))]
+        return spike_train_offsets, np.around(spike_times, decimals=1)
+
+    def __gather_spike_trains(self, spike_train_offsets, spike_times, comm,
+                              transformers_root_rank):
+        """
+        Gathers the spike trains (CSR layout) of all transformers on root, in
+        order of the ranks, with buffer based collectives (i.e. no pickling).
+
+        Returns
+        ------
+            spike_train_offsets, spike_times: numpy array, numpy array
+                on root, None otherwise
+        """
+        is_root = comm.Get_rank() == transformers_root_rank
+        spike_counts = np.ascontiguousarray(np.diff(spike_train_offsets), dtype=np.int64)
+        spike_times = np.ascontiguousarray(spike_times, dtype='d')
+        # 1) gather the number of spike trains and spikes of each rank
+        sizes = np.array([spike_counts.shape[0], spike_times.shape[0]], dtype=np.int64)
+        gathered_sizes = np.empty((comm.Get_size(), 2), dtype=np.int64) if is_root else None
+        comm.Gather([sizes, MPI.INT64_T],
+                    [gathered_sizes, MPI.INT64_T] if is_root else None,
+                    root=transformers_root_rank)
+
+        # 2) gather the spike counts and spike times
+        gathered_spike_counts = None
+        gathered_spike_times = None
+        receive_counts_buffer = None
+        receive_times_buffer = None
+        if is_root:
+            gathered_spike_counts = np.empty(gathered_sizes[:, 0].sum(), dtype=np.int64)
+            gathered_spike_times = np.empty(gathered_sizes[:, 1].sum(), dtype='d')
+            receive_counts_buffer = [gathered_spike_counts,
+                                     (gathered_sizes[:, 0], self.__displacements(gathered_sizes[:, 0])),
+                                     MPI.INT64_T]
+            receive_times_buffer = [gathered_spike_times,
+                                    (gathered_sizes[:, 1], self.__displacements(gathered_sizes[:, 1])),
+                                    MPI.DOUBLE]
+        comm.Gatherv([spike_counts, MPI.INT64_T],
+                     receive_counts_buffer,
+                     root=transformers_root_rank)
+        comm.Gatherv([spike_times, MPI.DOUBLE],
+                     receive_times_buffer,
+                     root=transformers_root_rank)
+        if not is_root:
             return None
+
+        # 3) one contiguous CSR on root
+        gathered_spike_train_offsets = np.zeros(gathered_spike_counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(gathered_spike_counts, out=gathered_spike_train_offsets[1:])
+        return gathered_spike_train_offsets, gathered_spike_times
+
+    def __displacements(self, counts):
+        """displacements of the blocks of given counts in a contiguous buffer"""
+        displacements = np.zeros(counts.shape[0], dtype=np.int64)
+        np.cumsum(counts[:-1], out=displacements[1:])
+        return displacements
@@ -0,0 +1,135 @@
+# ------------------------------------------------------------------------------
+#  Copyright 2020 Forschungszentrum Jülich GmbH and Aix-Marseille Université
+# "Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements; and to You under the Apache License,
+# Version 2.0. "
+#
+# Forschungszentrum Jülich
+# Institute: Institute for Advanced Simulation (IAS)
+# Section: Jülich Supercomputing Centre (JSC)
+# Division: High Performance Computing in Neuroscience
+# Laboratory: Simulation Laboratory Neuroscience
+# Team: Multi-scale Simulation and Design
+# ------------------------------------------------------------------------------
+import numpy as np
+
+
+class WorkloadPartitioner:
+    """
+    Splits a range of items (e.g. neurons) into contiguous chunks, one per
+    transformer, such that the workload (e.g. number of spikes) is balanced.
+
+    The workload per item is measured in each step and smoothed over the
+    steps. The split is recomputed only if the imbalance of the current split
+    exceeds the threshold.
+
+    NOTE the split is deterministic for the same measurements, so all
+    transformers compute the same split without communicating.
+    """
+    def __init__(self, number_of_items, number_of_parts,
+                 imbalance_threshold=0.1, smoothing_factor=0.5):
+        """
+        Parameters
+        ----------
+        number_of_items: int
+            number of items to be split e.g. neurons
+
+        number_of_parts: int
+            number of chunks e.g. transformers
+
+        imbalance_threshold: float
+            the split is recomputed if the largest load exceeds the mean load
+            by this fraction
+
+        smoothing_factor: float
+            weight of the latest measurement in the (exponential) moving
+            average of the workload per item
+        """
+        self.__number_of_parts = number_of_parts
+        self.__imbalance_threshold = imbalance_threshold
+        self.__smoothing_factor = smoothing_factor
+        self.__workload = None
+        self.__number_of_rebalances = 0
+        # initially, balance the number of items (same as np.array_split)
+        chunk_sizes = np.full(number_of_parts, number_of_items // number_of_parts, dtype=np.int64)
+        chunk_sizes[:number_of_items % number_of_parts] += 1
+        self.__boundaries = np.zeros(number_of_parts + 1, dtype=np.int64)
+        np.cumsum(chunk_sizes, out=self.__boundaries[1:])
+
+    @property
+    def boundaries(self): return self.__boundaries
+
+    @property
+    def number_of_rebalances(self): return self.__number_of_rebalances
+
+    def get_range(self, part):
+        """returns the (start, stop) of the items of the given part"""
+        return int(self.__boundaries[part]), int(self.__boundaries[part + 1])
+
+    def get_loads(self, workload=None):
+        """returns the load of each part as per the given (or smoothed) workload"""
+        if workload is None:
+            workload = self.__workload
+        if workload is None:
+            return np.diff(self.__boundaries).astype('d')
+        cumulative_workload = np.concatenate(([0.0], np.cumsum(workload)))
+        return np.diff(cumulative_workload[self.__boundaries])
+
+    def get_imbalance(self, workload=None):
+        """returns by which fraction the largest load exceeds the mean load"""
+        loads = self.get_loads(workload)
+        mean_load = loads.mean()
+        if mean_load == 0:
+            return 0.0
+        return float(loads.max() / mean_load - 1.0)
+
+    def update(self, workload):
+        """
+        updates the smoothed workload with the latest measurement and
+        recomputes the split if it is imbalanced
+
+        NOTE the split is kept if it is already as good as it can be, e.g.
+        if a single item is heavier than the mean load, or if the recomputed
+        split is not better
+
+        Returns
+        ------
+            True if the split is recomputed, False otherwise
+        """
+        workload = np.asarray(workload, dtype='d')
+        if self.__workload is None:
+            self.__workload = workload.copy()
+        else:
+            self.__workload *= (1.0 - self.__smoothing_factor)
+            self.__workload += self.__smoothing_factor * workload
+
+        imbalance = self.get_imbalance()
+        if imbalance <= self.__imbalance_threshold:
+            return False
+
+        # the largest load of any split is at least the heaviest item and
+        # the mean load
+        loads = self.get_loads()
+        lowest_largest_load = max(self.__workload.max(initial=0.0),
+                                  loads.sum() / self.__number_of_parts)
+        if loads.max() <= lowest_largest_load * (1.0 + self.__imbalance_threshold):
+            return False
+
+        # split the cumulative workload into equal parts, each boundary is
+        # put at the closer of the two item boundaries around its target
+        cumulative_workload = np.concatenate(([0.0], np.cumsum(self.__workload)))
+        targets = cumulative_workload[-1] * np.arange(1, self.__number_of_parts) / self.__number_of_parts
+        upper = np.searchsorted(cumulative_workload, targets, side='left')
+        upper = np.clip(upper, 1, cumulative_workload.shape[0] - 1)
+        lower = upper - 1
+        is_lower_closer = (targets - cumulative_workload[lower]) <= (cumulative_workload[upper] - targets)
+        boundaries = self.__boundaries.copy()
+        boundaries[1:-1] = np.maximum.accumulate(np.where(is_lower_closer, lower, upper))
+
+        # keep the new split only if it is better
+        new_loads = np.diff(cumulative_workload[boundaries])
+        if new_loads.max() >= loads.max():
+            return False
+        self.__boundaries = boundaries
+        self.__number_of_rebalances += 1
+        return True
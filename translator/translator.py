@@ -11,10 +11,15 @@
 # Laboratory: Simulation Laboratory Neuroscience
 # Team: Multi-scale Simulation and Design
 # ------------------------------------------------------------------------------
+import numpy as np
+
 from EBRAINS_InterscaleHUB.translator.elephant_delegator import ElephantDelegator
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import decode_spike_events
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import decode_compact_spike_events
+from EBRAINS_InterscaleHUB.translator.delegation.spike_event_decoder import COMPACT_SPIKE_EVENT_DTYPES
 from EBRAINS_ConfigManager.global_configurations_manager.xml_parsers.default_directories_enum import DefaultDirectories
-from EBRAINS_InterscaleHUB.common.interscalehub_enums import TRANSLATION_FUNCTION_ID
-from EBRAINS_InterscaleHUB.common.interscalehub_utils import debug_log_message
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import TRANSLATION_FUNCTION_ID, RATE_ENGINES
+from EBRAINS_InterscaleHUB.common.interscalehub_enums import SPIKE_EVENT_ENCODINGS
 
 
 class Translator:
@@ -41,7 +46,33 @@ class Translator:
         self.__elephant_delegator = ElephantDelegator(configurations_manager,
                                                       log_settings,
                                                       sci_params=sci_params)
+        # engine to convert the spikes to rates, see RATE_ENGINES
+        # NOTE elephant stays the default until the native engine is
+        # validated against it, see tests/test_spike_rate_inter_conversion.py
+        rate_engine = getattr(sci_params, 'rate_engine', RATE_ENGINES.ELEPHANT)
+        if isinstance(rate_engine, str):
+            rate_engine = RATE_ENGINES[rate_engine.upper()]
+        self.__rate_engine = RATE_ENGINES(rate_engine)
+        # encoding of the spike events in the INPUT buffer, see
+        # SPIKE_EVENT_ENCODINGS
+        spike_event_encoding = getattr(sci_params, 'spike_event_encoding', SPIKE_EVENT_ENCODINGS.RAW)
+        if isinstance(spike_event_encoding, str):
+            spike_event_encoding = SPIKE_EVENT_ENCODINGS[spike_event_encoding.upper()]
+        self.__spike_event_encoding = SPIKE_EVENT_ENCODINGS(spike_event_encoding)
+        # NOTE if set, the spike trains generated from the rates are not
+        # gathered, every transformer delivers its own part
+        self.__distributed_output = getattr(sci_params, 'direct_nest_delivery', True)
         self.__logger.debug("Initialised")
+
+    @property
+    def distributed_output(self): return self.__distributed_output
+
+    @distributed_output.setter
+    def distributed_output(self, distributed_output):
+        self.__distributed_output = distributed_output
+
+    @property
+    def rate_engine(self): return self.__rate_engine
     
     def translate(self,
                   translation_function_id,
@@ -50,11 +81,12 @@ class Translator:
                   raw_data,
                   transformer_intra_comm,
                   transformers_root_rank,
-                  *args):
+                  *args,
+                  spike_index=None):
         
         if translation_function_id == TRANSLATION_FUNCTION_ID.SPIKE_TO_RATES:
             return self._spikes_to_rates(count, raw_data, transformer_intra_comm,
-                                        transformers_root_rank)
+                                        transformers_root_rank, spike_index)
         
         if translation_function_id == TRANSLATION_FUNCTION_ID.RATE_TO_SPIKES:
             return self._rate_to_spikes(raw_data, transformer_intra_comm,
@@ -67,10 +99,12 @@ class Translator:
                                         transformer_intra_comm,
                                         transformers_root_rank)
     
-    def _spikes_to_rates(self, count, data, comm, root_transformer_rank):
+    def _spikes_to_rates(self, count, data, comm, root_transformer_rank,
+                         spike_index=None):
         """
-        i) Transforms the data from spikes to spiketrains, and then
-        ii) converts spiketrains into rates.
+        i) Groups the spike events by neurons, and then
+        ii) converts them into rates, either natively or by means of
+        spiketrains (see RATE_ENGINES).
         
         Parameters
         ----------
@@ -84,46 +118,140 @@ class Translator:
         data_buffer: MPI shared memory window
             buffer contains id of devices, id of neurons and spike times
 
+        spike_index: tuple of numpy arrays
+            spike events already grouped by neurons by the receivers i.e.
+            (spike_event_offsets, spike_times), if any
+
         Returns
         ------
              times, rate: numpy array, float
                 tuple of interval and the rate for the interval if data is
                 transformed successfully
         """
-        # 1) prepare spike events from raw data
-        nb_neurons = self.__sci_params.nb_neurons
-        first_neuron_id = self.__params['id_first_neurons'][0]
-        spike_events = [[] for _ in range(nb_neurons)]
-        
-        # NOTE NEST sends 3 values for each spike event i.e.
-        # (spike detector id, neuron id, spike time)
-        # --> Assumption: len(data) is always a multiple of 3
-        for index in range(int(len(data)/3)):
-            neuron_id = int(data[index*3+1])
-            spike_time = data[index*3+2]
-            spike_events[neuron_id - first_neuron_id].append(spike_time)
-        
-        # 2) transform spikes to spike_trains
-        spike_trains = self.__elephant_delegator.spike_events_to_spiketrains(
-            count,
-            spike_events,
-            comm,
-            root_transformer_rank)
+        # 1) group the spike events from raw data by neurons
+        # NOTE the spike times of neuron i are
+        # spike_times[spike_event_offsets[i]:spike_event_offsets[i+1]]
+        # Case a, the receivers already grouped them
+        if spike_index is not None:
+            spike_event_offsets, spike_times = spike_index
+        # Case b, the spike events are as sent by NEST
+        elif self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.RAW:
+            spike_event_offsets, spike_times = decode_spike_events(
+                data,
+                self.__params['id_first_neurons'][0],
+                self.__sci_params.nb_neurons)
+        # Case c, the spike events are encoded compactly by the receivers
+        else:
+            spike_event_offsets, spike_times = decode_compact_spike_events(
+                data.view(COMPACT_SPIKE_EVENT_DTYPES[self.__spike_event_encoding]),
+                self.__sci_params.nb_neurons,
+                self.__sci_params.dt
+                if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.COMPACT_TICKS else None)
         
-        # 3) convert the spike_trains to rate
-        # NOTE only root rank has the result (spike_trains)
+        # 2) convert the spikes to rate
+        # NOTE only root rank has the result
         times = None
         rate = None
-        if comm.Get_rank() == root_transformer_rank:
-            times, rate = self.__elephant_delegator.spiketrains_to_rate(count, spike_trains)
-        # wait until root rank is done with analysis
-        debug_log_message(rank=0,  # hardcoded
-                          logger=self.__logger,
-                          msg="wait until root transformer converts the "
-                          "spike_trains to rate")
-        comm.Barrier()
+        if self.__rate_engine == RATE_ENGINES.NATIVE:
+            # NOTE the rate is computed by all transformers together, the
+            # reduction of the partial results is the only sync up point
+            times, rate = self.__elephant_delegator.spike_events_to_rate(
+                count,
+                spike_event_offsets,
+                spike_times,
+                comm,
+                root_transformer_rank)
+        else:
+            # 2.1) transform spikes to spike_trains
+            spike_trains = self.__elephant_delegator.spike_events_to_spiketrains(
+                count,
+                spike_event_offsets,
+                spike_times,
+                comm,
+                root_transformer_rank)
+
+            # 2.2) convert the spike_trains to rate
+            if comm.Get_rank() == root_transformer_rank:
+                times, rate = self.__elephant_delegator.spiketrains_to_rate(count, spike_trains)
+                if self.__rate_engine == RATE_ENGINES.VALIDATE:
+                    _, native_rate = self.__elephant_delegator.spike_times_to_rate(
+                        count,
+                        spike_times,
+                        self.__sci_params.nb_neurons)
+                    self.__log_rate_deviation(count, rate, native_rate)
+        # NOTE the other transformers do not wait for the root transformer,
+        # they do not need the rate
         return times, rate
 
+    def spike_package_to_histogram(self, count, package):
+        """
+        Counts the spike times of a single package (i.e. the spike events
+        received from one NEST rank) on the sampling grid of the given step.
+
+        NOTE the pooled histogram does not depend on which neuron a spike
+        belongs to, so the packages are counted as they are, without grouping
+        the spike events by neurons
+
+        Parameters
+        ----------
+        count: int
+            counter of the number of time of the transformation
+
+        package: numpy array
+            spike events of the package as stored in the INPUT buffer, see
+            SPIKE_EVENT_ENCODINGS
+
+        Returns
+        ------
+            partial_histogram: numpy array (int64)
+        """
+        # Case a, the spike events are as sent by NEST
+        if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.RAW:
+            spike_times = package[:(package.shape[0] // 3) * 3].reshape(-1, 3)[:, 2]
+        # Case b, the spike events are encoded compactly by the receivers
+        else:
+            spike_times = package.view(
+                COMPACT_SPIKE_EVENT_DTYPES[self.__spike_event_encoding])['time'].astype('d')
+            if self.__spike_event_encoding == SPIKE_EVENT_ENCODINGS.COMPACT_TICKS:
+                spike_times *= self.__sci_params.dt
+        return np.ascontiguousarray(
+            self.__elephant_delegator.spike_times_to_histogram(count, spike_times),
+            dtype=np.int64)
+
+    def partial_histograms_to_rate(self, count, partial_histogram, comm,
+                                   root_transformer_rank):
+        """
+        Converts the histograms of the packages counted by all transformers
+        (see spike_package_to_histogram) into the rate.
+
+        Returns
+        ------
+            times, rate: numpy array, numpy array
+                on root, None otherwise
+        """
+        return self.__elephant_delegator.partial_histograms_to_rate(
+            count,
+            partial_histogram,
+            self.__sci_params.nb_neurons,
+            comm,
+            root_transformer_rank)
+
+    def __log_rate_deviation(self, count, reference_rate, native_rate):
+        """logs the deviation of the native rate from the reference rate"""
+        reference_rate = np.asarray(reference_rate).ravel()
+        if reference_rate.shape != native_rate.shape:
+            self.__logger.warning(f"step: {count}, shape of native rate: "
+                                  f"{native_rate.shape} differs from reference: "
+                                  f"{reference_rate.shape}")
+            return
+        deviation = np.max(np.abs(reference_rate - native_rate), initial=0.0)
+        if not np.allclose(reference_rate, native_rate):
+            self.__logger.warning(f"step: {count}, native rate deviates from "
+                                  f"reference by: {deviation}")
+        else:
+            self.__logger.debug(f"step: {count}, native rate deviates from "
+                                f"reference by: {deviation}")
+
     def _rate_to_spikes(self, raw_data, transformer_intra_comm, transformers_root_rank):
         """Transforms the data from one format to another .
         
@@ -137,11 +265,18 @@ class Translator:
         
         Returns
         ------
-            returns the spike trains from rate
+            returns the spike trains from rate as offsets and spike times
+            (CSR layout), or in case of distributed output, the first neuron
+            along with the offsets and spike times of the neurons of this
+            transformer
         """
         # NOTE the first two indexes are always the time steps
         time_step = raw_data[:2]
         rates = raw_data[2:]
+        if self.__distributed_output:
+            return self.__elephant_delegator.rate_to_partial_spikes(time_step,
+                                                                    rates,
+                                                                    transformer_intra_comm)
         return self.__elephant_delegator.rate_to_spikes(time_step,
                                                         rates,
                                                         transformer_intra_comm,